@@ -28,6 +28,13 @@ class BatchException(Exception):
 
 DEBUGGING = True
 
+# The states of a job in AWS Batch
+STATUSES = ['SUBMITTED', 'PENDING', 'RUNNABLE',
+            'STARTING', 'RUNNING', 'SUCCEEDED', 'FAILED']
+
+# The most job ids accepted by one call to describe_jobs
+DESCRIBE_JOBS_MAX = 100
+
 def abort(msg1, msg2=None, data=None, verbose=False):
     """Abort a Batch method with debugging information."""
     code = clienterror.code(data)
@@ -122,7 +129,7 @@ class Batch:
         return found
 
     def submit_job(self, jobname=None, jobqueue=None, jobdefinition=None,
-                   command=None, memory=None, dependson=None):
+                   command=None, memory=None, dependson=None, vcpus=None):
         """Run the job given by cmd in the batch environment."""
 
         # pylint: disable=too-many-arguments
@@ -137,6 +144,8 @@ class Batch:
             overrides['command'].extend(['--region', self.region])
         if memory is not None:
             overrides['memory'] = memory
+        if vcpus is not None:
+            overrides['vcpus'] = vcpus
         # Should test that depends is a list of strings
         dependson = [{'jobId': jid} for jid in dependson or []]
 
@@ -154,37 +163,86 @@ class Batch:
         jobname = result.get('jobName', None)
         return {'jobid': jobid, 'jobname': jobname}
 
-    def job_status(self, jobid=None, jobname=None):
+    def list_jobs(self, statuses=None):
         """
-        Get the job status of every job matching a given job id or job name.
+        Generate a summary of every job on the job queue in each status.
+
+        Each summary is a dict with keys jobId, jobName, and status.
+        """
+
+        for status in statuses or STATUSES:
+            kwargs = {'jobQueue': self.jobqueue,
+                      'jobStatus': status,
+                      'maxResults': 1000}
+            while True:
+                try:
+                    response = self.client.list_jobs(**kwargs)
+                    summaries = response['jobSummaryList']
+                except ClientError as exc:
+                    abort("Failed to list jobs on queue: {}"
+                          .format(self.jobqueue),
+                          data=exc)
+                except KeyError as exc:
+                    abort("Failed to list {} jobs on queue: {}"
+                          .format(status, self.jobqueue),
+                          data=exc)
+                for job in summaries:
+                    yield {'jobId': job['jobId'],
+                           'jobName': job['jobName'],
+                           'status': status}
+                if not response.get('nextToken'):
+                    break
+                kwargs['nextToken'] = response['nextToken']
+
+    def describe_jobs(self, jobids):
+        """
+        Get the job status of every job in a list of job ids.
+
+        Job ids unknown to Batch are omitted from the results.
         """
 
         results = []
-        for status in ['SUBMITTED', 'PENDING', 'RUNNABLE',
-                       'STARTING', 'RUNNING', 'SUCCEEDED', 'FAILED']:
+        for idx in range(0, len(jobids), DESCRIBE_JOBS_MAX):
+            chunk = jobids[idx:idx+DESCRIBE_JOBS_MAX]
             try:
-                response = self.client.list_jobs(
-                    jobQueue=self.jobqueue,
-                    jobStatus=status,
-                    maxResults=1000
-                    )
-                for job in response['jobSummaryList']:
-                    job_id = job['jobId']
-                    job_name = job['jobName']
-                    if (jobid and re.search(jobid, job_id) or
-                            jobname and re.search(jobname, job_name)):
-                        results.append({'jobId': job_id,
-                                        'jobName': job_name,
-                                        'status': status})
-            except ClientError as exc:
-                abort("Failed to list jobs on queue: {}".format(self.jobqueue),
-                      data=exc)
-            except KeyError as exc:
-                abort("Failed to list {} jobs on queue: {}"
-                      .format(status, self.jobqueue),
+                response = self.client.describe_jobs(jobs=chunk)
+                for job in response['jobs']:
+                    results.append({'jobId': job['jobId'],
+                                    'jobName': job['jobName'],
+                                    'status': job['status']})
+            except (ClientError, KeyError) as exc:
+                abort("Failed to describe jobs: {}".format(', '.join(chunk)),
                       data=exc)
         return results
 
+    def job_status(self, jobid=None, jobname=None):
+        """
+        Get the job status of every job matching a given job id or job name.
+        """
+
+        results = []
+        for job in self.list_jobs():
+            if (jobid and re.search(jobid, job['jobId']) or
+                    jobname and re.search(jobname, job['jobName'])):
+                results.append(job)
+        return results
+
+    def job_statuses(self, jobnames):
+        """
+        Get the job status of every task of each of a list of job names.
+
+        Returns a dict mapping each job name to the list of its tasks
+        (the jobs on the queue named jobname-task, like jobname-build),
+        listing the jobs on the queue just once for all job names.
+        """
+
+        results = {jobname: [] for jobname in jobnames}
+        for job in self.list_jobs():
+            jobname = job['jobName'].rsplit('-', 1)[0]
+            if jobname in results:
+                results[jobname].append(job)
+        return results
+
     def kill_job(self, jobid=None, jobname=None):
         """
         Kill every job matching a given job id or job name.
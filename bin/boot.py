@@ -15,9 +15,9 @@ def boot():
     opts = options.docker_options()
     print("Booting with options " + json.dumps(opts))
 
-    package.copy('cbmc-batch', opts['pkgbucket'], opts['batchpkg'])
-    package.install('cbmc-batch', opts['batchpkg'], 'cbmc-batch')
-    package.launch('cbmc-batch', 'docker.py', ['--jsons', json.dumps(opts)])
+    package.copy_and_install('cbmc-batch', opts['pkgbucket'],
+                             opts['batchpkg'], 'cbmc-batch', opts['region'])
+    package.run('cbmc-batch', 'docker', ['--jsons', json.dumps(opts)])
 
 if __name__ == "__main__":
     boot()
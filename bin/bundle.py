@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Bundles of files stored as one S3 object.
+
+A bundle is a zip archive.  The central directory at the end of the
+archive is an index giving the offset of each member, so a reader
+can fetch the index and then a single member with ranged GETs instead
+of fetching the whole bundle.  A phase writing its outputs as a
+bundle makes one PUT instead of one PUT per file (the html report
+alone is hundreds of files).
+
+Run as a script to list or extract the members of a bundle:
+
+    bundle.py s3://bucket/job/out/bundle-report.zip --list
+    bundle.py s3://bucket/job/out/bundle-report.zip --extract DIR html
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+from pprint import pprint
+
+import boto3
+from botocore.exceptions import ClientError
+
+import clienterror
+import s3
+
+################################################################
+
+class BundleException(Exception):
+    """Exception thrown by bundle methods."""
+
+    def __init__(self, msg):
+        super(BundleException, self).__init__()
+        self.message = msg
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return self.message
+
+################################################################
+
+DEBUGGING = True
+
+def abort(msg1, msg2=None, data=None, verbose=False):
+    """Abort a bundle method with debugging information."""
+    code = clienterror.code(data)
+    msgs = [msg1]
+    if code is not None:
+        msgs.append(" ({})".format(code))
+    if msg2 is not None:
+        msgs.append(": {}".format(msg2))
+    msg = ''.join(msgs)
+    if verbose or DEBUGGING:
+        print("Bundle Exception: {}".format(msg))
+        pprint(clienterror.response(data) or data)
+    raise BundleException(msg)
+
+################################################################
+
+READAHEAD = 256 * 1024 # The fewest bytes fetched by one ranged GET
+
+def bundle_name(phase):
+    """The name of the bundle of the outputs of a phase"""
+
+    return "bundle-{}.zip".format(phase)
+
+class S3File(object):
+    """A read-only, seekable file reading an S3 object with ranged GETs
+
+    Each GET fetches at least READAHEAD bytes, so the many small reads
+    made by zipfile cost few requests.
+    """
+
+    def __init__(self, path, client=None, region=None):
+        self.client = client or boto3.client('s3', region_name=region)
+        self.bucket = s3.bucket_name(path)
+        self.key = s3.key_name(path)
+        try:
+            response = self.client.head_object(Bucket=self.bucket,
+                                               Key=self.key)
+        except ClientError as exc:
+            abort("Can't open bundle", path, exc)
+        self.size = response['ContentLength']
+        self.position = 0
+        self.buffer = b''
+        self.buffer_start = 0
+
+    def seekable(self):
+        """A bundle supports random access"""
+        # pylint: disable=no-self-use
+        return True
+
+    def tell(self):
+        """The current position in the object"""
+        return self.position
+
+    def seek(self, offset, whence=0):
+        """Change the current position in the object"""
+        if whence == 0:
+            self.position = offset
+        elif whence == 1:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        self.position = max(0, min(self.position, self.size))
+        return self.position
+
+    def fetch(self, start, end):
+        """Fetch bytes start up to (but not including) end"""
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.key,
+            Range="bytes={}-{}".format(start, end - 1))
+        return response['Body'].read()
+
+    def read(self, size=-1):
+        """Read size bytes (or the rest of the object) from the position"""
+        end = self.size if size is None or size < 0 \
+              else min(self.size, self.position + size)
+        if self.position >= end:
+            return b''
+        buffer_end = self.buffer_start + len(self.buffer)
+        if not self.buffer_start <= self.position or not end <= buffer_end:
+            self.buffer_start = self.position
+            self.buffer = self.fetch(
+                self.position,
+                min(self.size, max(end, self.position + READAHEAD)))
+        offset = self.position - self.buffer_start
+        data = self.buffer[offset:offset + end - self.position]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        """Release the buffer"""
+        self.buffer = b''
+
+################################################################
+
+def write(directory, names, filename):
+    """Write the files (and directories) named in directory to a bundle"""
+
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name in names:
+            path = os.path.join(directory, name)
+            if not os.path.isdir(path):
+                archive.write(path, name)
+                continue
+            for (root, _, files) in os.walk(path):
+                for member in sorted(files):
+                    member = os.path.join(root, member)
+                    archive.write(member, os.path.relpath(member, directory))
+
+def put(directory, names, path, client=None, region=None):
+    """Write the files named in directory to a bundle in S3"""
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir, os.path.basename(path))
+        write(directory, names, filename)
+        s3.copy_file_to_object(filename, path, client, region)
+    finally:
+        shutil.rmtree(tempdir)
+
+def open_bundle(path, client=None, region=None):
+    """Open a bundle in S3 for reading its members"""
+
+    return zipfile.ZipFile(S3File(path, client, region))
+
+def members(archive, names):
+    """The members of an open bundle that are the named files or are in
+    the named directories"""
+
+    return [member for member in archive.namelist()
+            if any(member == name or member.startswith(name.rstrip('/') + '/')
+                   for name in names)]
+
+def extract(path, names, directory, client=None, region=None):
+    """Copy the named files (and directories) in a bundle to directory"""
+
+    archive = open_bundle(path, client, region)
+    try:
+        found = members(archive, names)
+        for member in found:
+            archive.extract(member, directory)
+    finally:
+        archive.close()
+    return found
+
+################################################################
+
+def main():
+    """List or extract the members of a bundle"""
+
+    parser = argparse.ArgumentParser(
+        description='List or extract the members of a bundle in S3')
+    parser.add_argument('bundle', metavar='OBJ',
+                        help='S3 path to the bundle')
+    parser.add_argument('names', metavar='NAME', nargs='*',
+                        help='Files or directories to extract (default: all)')
+    parser.add_argument('--list', action='store_true',
+                        help='List the members of the bundle')
+    parser.add_argument('--extract', metavar='DIR',
+                        help='Extract the members of the bundle to DIR')
+    parser.add_argument('--region', metavar='REGION',
+                        help='AWS region of the bucket')
+    args = parser.parse_args()
+
+    archive = open_bundle(args.bundle, region=args.region)
+    try:
+        names = (members(archive, args.names) if args.names
+                 else archive.namelist())
+        if args.list or not args.extract:
+            for name in names:
+                print(name)
+        if args.extract:
+            for name in names:
+                archive.extract(name, args.extract)
+    finally:
+        archive.close()
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
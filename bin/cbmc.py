@@ -7,6 +7,8 @@ from pprint import pprint
 import json
 
 import clienterror
+import s3
+import workqueue
 from batch import Batch
 
 ################################################################
@@ -44,6 +46,19 @@ def abort(msg1, msg2=None, data=None, verbose=False):
 
 ################################################################
 
+def fused_memory(opts):
+    """The memory needed to run all the steps of a job in one container
+
+    The property and coverage steps run concurrently.
+    """
+
+    return max(opts['build_memory'] if opts['build'] else 0,
+               (opts['property_memory'] if opts['property'] else 0) +
+               (opts['coverage_memory'] if opts['coverage'] else 0),
+               opts['report_memory'] if opts['report'] else 0)
+
+################################################################
+
 class CBMC:
     """A running instance of CBMC"""
 
@@ -119,13 +134,76 @@ class CBMC:
         return self.batch.submit_job(jobname=jobname, command=full_flags,
                                      memory=memory, dependson=dependson)
 
+    def launch_fused(self, flags=None):
+        """Run all the steps in one container"""
+
+        flags = flags or []
+        jobname = "{}-fused".format(self.jobname)
+        full_flags = flags +  ['--dofused', '--jobname', jobname]
+        memory = fused_memory(self.opts)
+
+        return self.batch.submit_job(jobname=jobname, command=full_flags,
+                                     memory=memory)
+
+    def enqueue_fused(self):
+        """Add a task running all the steps to the queue of workers"""
+
+        queue = workqueue.open_queue(self.opts['queue'], self.opts['region'])
+        queue.put(self.opts)
+        return {'jobid': None, 'jobname': "{}-fused".format(self.jobname)}
+
+    def fused(self):
+        """Run all steps in one container: as requested, or if small
+
+        Jobs are small only if a fused threshold is given.
+        """
+
+        if self.opts.get('fused') is not None:
+            return self.opts['fused']
+        if self.opts.get('fused-threshold') is None:
+            return False
+        memory = max(self.opts['build_memory'],
+                     self.opts['property_memory'],
+                     self.opts['coverage_memory'],
+                     self.opts['report_memory'])
+        return memory <= self.opts['fused-threshold']
+
+    def phase_command(self, **jobs):
+        """The command for a job overlapping the phase jobs given"""
+
+        jobids = {phase: job['jobid'] for phase, job in jobs.items()
+                  if job['jobid'] is not None}
+        opts = dict(self.opts, **{'phase-jobids': jobids})
+        return ['--jsons', json.dumps(opts)]
+
     def submit_jobs(self):
         """
         Submit CBMC jobs to CBMC patch
+
+        With the overlap option, the jobs are submitted without
+        dependencies, and each job waits on the locks of the jobs it
+        depends on (after staging its inputs), given the ids of those
+        jobs to check that they have not failed.  With the queue option,
+        a job running all the steps in one container is added to the
+        queue as a task instead.
         """
 
         command = ['--jsons', json.dumps(self.opts)]
 
+        if self.fused():
+            if self.opts.get('queue'):
+                fused_job = self.enqueue_fused()
+            else:
+                fused_job = self.launch_fused(command)
+            none_job = {'jobid': None, 'jobname': None}
+            return {
+                'jobname': self.jobname,
+                'build': fused_job if self.build else none_job,
+                'property': fused_job if self.property else none_job,
+                'coverage': fused_job if self.coverage else none_job,
+                'report': fused_job if self.report else none_job,
+                }
+
         build_job = {'jobid': None, 'jobname': None}
         property_job = {'jobid': None, 'jobname': None}
         coverage_job = {'jobid': None, 'jobname': None}
@@ -133,15 +211,25 @@ class CBMC:
         buildjob = []
         propertyjob = []
         coveragejob = []
+        overlap = self.opts.get('overlap')
         if self.build:
             build_job = self.launch_build(command)
-            buildjob = [build_job['jobid']]
+            if not overlap:
+                buildjob = [build_job['jobid']]
+        if overlap:
+            command = self.phase_command(build=build_job)
         if self.property:
             property_job = self.launch_property(command, dependson=buildjob)
-            propertyjob = [property_job['jobid']]
+            if not overlap:
+                propertyjob = [property_job['jobid']]
         if self.coverage:
             coverage_job = self.launch_coverage(command, dependson=buildjob)
-            coveragejob = [coverage_job['jobid']]
+            if not overlap:
+                coveragejob = [coverage_job['jobid']]
+        if overlap:
+            command = self.phase_command(build=build_job,
+                                         property=property_job,
+                                         coverage=coverage_job)
         if self.report:
             report_job = self.launch_report(command,
                                             dependson=(propertyjob+coveragejob))
@@ -157,3 +245,79 @@ class CBMC:
         return results
 
 ################################################################
+# Packs
+#
+# A pack runs many small jobs in one container, each job running all
+# of its steps (as a fused job) in a pool of processes.  The options
+# for the jobs are written to a manifest in the bucket, and each job
+# writes its status to PACK_STATUS in its output bucket.
+
+PACK_SLOTS = 8 # The number of jobs a pack runs at once
+PACK_MANIFEST = 'manifest.json'
+PACK_STATUS = 'pack-status.json'
+
+def pack_manifest(bucket, packname):
+    """The object holding the manifest for a pack"""
+
+    return "{}/{}/{}".format(s3.path_url(bucket), packname, PACK_MANIFEST)
+
+def submit_pack(jobs, packname):
+    """Submit one job running the given jobs (options for cbmc-batch)"""
+
+    first = jobs[0]
+    manifest = pack_manifest(first['bucket'], packname)
+    s3.write_object(manifest, json.dumps(jobs), region=first['region'])
+
+    slots = min(len(jobs), PACK_SLOTS)
+    memory = slots * max(fused_memory(job) for job in jobs)
+    jobname = "{}-pack".format(packname)
+    command = ['--jsons', json.dumps(first),
+               '--dopack', '--manifest', manifest, '--jobname', jobname]
+
+    batch = Batch(jobname=first['jobdef'], queuename=first['jobqueue'],
+                  region=first['region'])
+    return batch.submit_job(jobname=jobname, command=command,
+                            memory=memory, vcpus=slots)
+
+################################################################
+# Workers
+#
+# A worker is a long-lived job serving a queue of tasks, each task
+# running all the steps of a job (as a fused job).  A worker keeps
+# packages installed and sources copied between tasks, writes the
+# status of each task to PACK_STATUS in the task's output bucket, and
+# announces the end of each task with an event in the form of the
+# event AWS Batch sends at the end of a fused job.
+
+WORKER_EVENT_SOURCE = 'cbmc-batch.worker'
+WORKER_EVENT_TYPE = 'Batch Job State Change'
+
+def worker_memory(opts):
+    """The memory a worker needs to run any task it may be given
+
+    Only jobs run in one container are queued.  Unless requested with
+    --fused, such a job has no phase needing more than the
+    fused-threshold memory, and runs its property and coverage phases
+    concurrently.
+    """
+
+    memory = fused_memory(opts)
+    if opts.get('fused-threshold'):
+        memory = max(memory, 2 * opts['fused-threshold'])
+    return memory
+
+def submit_workers(opts, count):
+    """Submit jobs running workers serving the queue named in opts"""
+
+    batch = Batch(jobname=opts['jobdef'], queuename=opts['jobqueue'],
+                  region=opts['region'])
+    workers = []
+    for index in range(count):
+        jobname = "{}-worker-{}".format(opts['jobname'], index)
+        command = ['--jsons', json.dumps(opts),
+                   '--doworker', '--jobname', jobname]
+        workers.append(batch.submit_job(jobname=jobname, command=command,
+                                        memory=worker_memory(opts)))
+    return workers
+
+################################################################
@@ -0,0 +1,104 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Machine-readable summary of the results of the CBMC property phase.
+
+The property phase writes the summary to a small json file next to
+the CBMC output so that consumers like continuous integration and
+dashboards need not download and parse the full CBMC output.
+"""
+
+import json
+import re
+
+################################################################
+
+RESULT_JSON = 'result.json'
+
+SUCCESSFUL = 'SUCCESSFUL'
+FAILED = 'FAILED'
+ERROR = 'ERROR'
+
+# The verdict lines ending the output of CBMC
+VERDICT_LINES = {
+    'VERIFICATION SUCCESSFUL': SUCCESSFUL,
+    'VERIFICATION FAILED': FAILED
+}
+
+# Match "[main.assertion.1] line 5 assertion x == 0: FAILURE"
+FAILURE_REGEXP = r'^\[([^\]]+)\] .*: FAILURE$'
+# Match "Runtime decision procedure: 0.123s"
+SOLVER_REGEXP = r'^Runtime decision procedure: ([0-9.]+)s$'
+# Match "Generated 12 VCC(s), 3 remaining after simplification"
+VCC_REGEXP = r'^Generated ([0-9]+) VCC\(s\), ([0-9]+) remaining'
+
+################################################################
+
+def summarize(cbmc_txt, returncode=None, peak_memory=None):
+    """Summarize the CBMC output in the file cbmc_txt.
+
+    The return code of CBMC and the peak memory used by CBMC in
+    megabytes are recorded in the summary if given.
+    """
+
+    verdict = None
+    failures = []
+    solver_time = None
+    vccs = None
+    vccs_remaining = None
+
+    with open(cbmc_txt) as output:
+        for line in output:
+            line = line.strip()
+            if line in VERDICT_LINES:
+                verdict = VERDICT_LINES[line]
+                continue
+            match = re.match(FAILURE_REGEXP, line)
+            if match:
+                failures.append(match.group(1))
+                continue
+            match = re.match(SOLVER_REGEXP, line)
+            if match:
+                # CBMC reports a time for each call to the solver
+                solver_time = (solver_time or 0.0) + float(match.group(1))
+                continue
+            match = re.match(VCC_REGEXP, line)
+            if match:
+                vccs = int(match.group(1))
+                vccs_remaining = int(match.group(2))
+                continue
+
+    return {
+        'verdict': verdict or ERROR,
+        'failed-properties': failures,
+        'solver-time': solver_time,
+        'vccs': vccs,
+        'vccs-remaining': vccs_remaining,
+        'peak-memory': peak_memory,
+        'returncode': returncode
+    }
+
+def write(result, filename=RESULT_JSON):
+    """Write a result summary to a json file."""
+
+    with open(filename, 'w') as output:
+        json.dump(result, output, indent=2, sort_keys=True)
+
+def parse(string):
+    """Parse a result summary from a json string."""
+
+    return json.loads(string)
+
+def expected_verdict(expected):
+    """The verdict implied by an expected substring of the CBMC output.
+
+    The verdict is None if the expected substring says nothing about
+    the verdict, in which case only the CBMC output itself can decide
+    if the output contains the expected substring.
+    """
+
+    if isinstance(expected, bytes):
+        expected = expected.decode('utf-8')
+    return VERDICT_LINES.get(expected.strip())
+
+################################################################
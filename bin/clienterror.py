@@ -53,5 +53,16 @@ def is_forbidden(exc):
 
     return code(exc) == '403'
 
+def is_precondition_failed(exc):
+    """ClientError is 412 (PreconditionFailed) from a conditional request."""
+
+    return code(exc) in ['PreconditionFailed', '412']
+
+def is_conditional_conflict(exc):
+    """ClientError is 409 (ConditionalRequestConflict) from a conditional
+    request racing another request for the same object."""
+
+    return code(exc) in ['ConditionalRequestConflict', '409']
+
 if __name__ == "__main__":
     print(code(None))
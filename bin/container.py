@@ -0,0 +1,61 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Install the packages and copy the source a job needs into a container"""
+
+import os
+import subprocess
+import sys
+
+import package
+import s3
+
+def abort(msg):
+    """Abort setting up a docker container"""
+    sys.stdout.flush()
+    print(msg)
+    sys.stdout.flush()
+    raise UserWarning(msg)
+
+def install_cbmc(opts):
+    """Install CBMC binaries"""
+    package.copy_and_install('cbmc', opts['pkgbucket'], opts['cbmcpkg'],
+                             'cbmc', opts['region'])
+
+def install_viewer(opts):
+    """Install the cbmc-viewer tool"""
+    package.copy_and_install('cbmc-viewer', opts['pkgbucket'],
+                             opts['viewerpkg'], 'cbmc-viewer', opts['region'])
+
+def get_buckets(opts, copysrc=True):
+    """Copy source and workspace buckets to container."""
+
+    if copysrc:
+        get_source(opts)
+    s3.sync_bucket_to_directory(opts['wsbucket'], opts['wsdir'])
+
+def get_source(opts):
+    """Copy source bucket (or source tar file) to container."""
+
+    if opts['srctarfile']:
+        tarfile = s3.key_name(opts['srctarfile'])
+        tardir = os.path.dirname(opts['srcdir'].rstrip('/'))
+        s3.copy_object_to_file(
+            opts['srctarfile'], tarfile, region=opts['region'])
+        if not os.path.isdir(tardir):
+            try:
+                os.makedirs(tardir)
+            except OSError:
+                abort("Failed to make directory {}".format(tardir))
+        cmd = ['tar', 'fx', tarfile, '-C', tardir]
+        try:
+            subprocess.check_call(cmd)
+        except subprocess.CalledProcessError:
+            abort("Failed to run command {}".format(' '.join(cmd)))
+        if not os.path.isdir(opts['srcdir']):
+            abort("Failed to create {} by untarring {}"
+                  .format(opts['srcdir'], opts['srctarfile']))
+    else:
+        s3.sync_bucket_to_directory(opts['srcbucket'], opts['srcdir'])
+        # make scripts in the source tree executable
+        subprocess.check_call(['chmod', '+x', '-R', opts['srcdir']])
@@ -12,12 +12,20 @@ from pprint import pprint
 import time
 import shutil
 import re
+import traceback
+from multiprocessing.pool import ThreadPool
 
 import boto3
 
 import s3
 import options
-import package
+import cbmcresult
+import lock
+import bundle
+import container
+import reportupload
+import worker
+from batch import Batch
 
 def abort(msg):
     """Abort a docker container"""
@@ -26,48 +34,251 @@ def abort(msg):
     sys.stdout.flush()
     raise UserWarning(msg)
 
-def install_cbmc(opts):
-    """Install CBMC binaries"""
-    package.copy('cbmc', opts['pkgbucket'], opts['cbmcpkg'])
-    package.install('cbmc', opts['cbmcpkg'], 'cbmc')
-
-def install_viewer(opts):
-    """Install the cbmc-viewer tool"""
-    package.copy('cbmc-viewer', opts['pkgbucket'], opts['viewerpkg'])
-    package.install('cbmc-viewer', opts['viewerpkg'], 'cbmc-viewer')
-
-def get_buckets(opts, copysrc=True):
-    """Copy input buckets to container."""
-
-    if copysrc:
-        if opts['srctarfile']:
-            tarfile = s3.key_name(opts['srctarfile'])
-            tardir = os.path.dirname(opts['srcdir'].rstrip('/'))
-            s3.copy_object_to_file(
-                opts['srctarfile'], tarfile, region=opts['region'])
-            try:
-                os.makedirs(tardir)
-            except OSError:
-                abort("Failed to make directory {}".format(tardir))
-            cmd = ['tar', 'fx', tarfile, '-C', tardir]
-            try:
-                subprocess.check_call(cmd)
-            except subprocess.CalledProcessError:
-                abort("Failed to run command {}".format(' '.join(cmd)))
-            if not os.path.isdir(opts['srcdir']):
-                abort("Failed to create {} by untarring {}"
-                      .format(opts['srcdir'], opts['srctarfile']))
+################################################################
+# Phase manifests
+#
+# Each phase declares the files it reads from the phases it depends
+# on (its inputs) and the files it writes (its outputs).  A phase
+# copies only its inputs to the container and only its outputs to the
+# output bucket, together with a manifest naming the outputs copied.
+# A phase looks for an input in the manifests of the phases it depends
+# on, and otherwise in the workspace bucket (a goto program built
+# before the job, say).  Only the build phase copies the workspace.
+#
+# With the bundle option, a phase writes its outputs as one bundle and
+# a phase reads its inputs from a bundle with ranged GETs.  The report
+# index page is still copied as an object of its own.
+
+PHASE_DEPENDS = {
+    'build': [],
+    'property': ['build'],
+    'coverage': ['build'],
+    'report': ['build', 'property', 'coverage']
+}
+
+def phase_inputs(opts, phase):
+    """The files a phase reads from the phases it depends on"""
+
+    return {
+        'build': [],
+        'property': [opts['goto']],
+        'coverage': [opts['goto']],
+        'report': [opts['goto'], 'cbmc.txt', 'property.xml', 'coverage.xml',
+                   cbmcresult.RESULT_JSON]
+    }[phase]
+
+def phase_outputs(opts, phase):
+    """The files (and directories) a phase writes"""
+
+    return {
+        'build': [opts['goto'], 'build.txt', 'build-err.txt', 'build-ps.txt'],
+        'property': ['cbmc.txt', 'cbmc-err.txt', 'cbmc-ps.txt',
+                     'property.xml', 'property-err.txt', 'property-ps.txt',
+                     cbmcresult.RESULT_JSON],
+        'coverage': ['coverage.xml', 'coverage-err.txt', 'coverage-ps.txt'],
+        'report': reportupload.report_outputs(opts)
+    }[phase]
+
+def phase_manifest(opts, phase):
+    """The object holding the manifest of a phase"""
+
+    return "{}/manifest-{}.json".format(opts['outbucket'], phase)
+
+def read_manifest(opts, phase):
+    """The manifest of a phase (None if none)"""
+
+    path = phase_manifest(opts, phase)
+    if not s3.object_exists(path, region=opts['region']):
+        return None
+    return json.loads(s3.read_object(path, region=opts['region']))
+
+def get_inputs(opts, phase):
+    """Copy the inputs of a phase to container."""
+
+    if not os.path.isdir(opts['wsdir']):
+        os.makedirs(opts['wsdir'])
+
+    outputs = set()
+    bundles = {}
+    for depend in PHASE_DEPENDS[phase]:
+        manifest = opts[depend] and read_manifest(opts, depend)
+        if not manifest:
+            continue
+        if manifest.get('bundle'):
+            for name in manifest['outputs']:
+                bundles[name] = manifest['bundle']
         else:
-            s3.sync_bucket_to_directory(opts['srcbucket'], opts['srcdir'])
-            # make scripts in the source tree executable
-            subprocess.check_call(['chmod', '+x', '-R', opts['srcdir']])
-    s3.sync_bucket_to_directory(opts['wsbucket'], opts['wsdir'])
-    s3.sync_bucket_to_directory(opts['outbucket'], opts['wsdir'])
+            outputs.update(manifest['outputs'])
+
+    inputs = phase_inputs(opts, phase)
+    for bundled in sorted(set(bundles[name] for name in inputs
+                              if name in bundles)):
+        names = [name for name in inputs if bundles.get(name) == bundled]
+        bundle.extract("{}/{}".format(opts['outbucket'], bundled), names,
+                       opts['wsdir'], region=opts['region'])
+
+    def get_input(name):
+        """Copy an input from the first bucket holding it"""
+
+        buckets = ([opts['outbucket']] if name in outputs
+                   else [opts['wsbucket'], opts['outbucket']])
+        for bucket in buckets:
+            path = "{}/{}".format(bucket, name)
+            if s3.object_exists(path, region=opts['region']):
+                break
+        else:
+            print("Input not found for {} phase: {}".format(phase, name))
+            return
+        filename = os.path.join(opts['wsdir'], name)
+        try:
+            os.makedirs(os.path.dirname(filename))
+        except OSError:
+            pass # the directory exists
+        s3.copy_object_to_file(path, filename, region=opts['region'])
+
+    s3.concurrently(get_input,
+                    [name for name in inputs if name not in bundles])
+
+def put_outputs(opts, phase):
+    """Copy the outputs of a phase to bucket, and write its manifest."""
+
+    outputs = [name for name in phase_outputs(opts, phase)
+               if os.path.exists(os.path.join(opts['wsdir'], name))]
+
+    if opts['bundle']:
+        name = bundle.bundle_name(phase)
+        bundled = [output for output in outputs
+                   if output not in reportupload.UNBUNDLED]
+        bundle.put(opts['wsdir'], bundled,
+                   "{}/{}".format(opts['outbucket'], name),
+                   region=opts['region'])
+        for output in outputs:
+            if output not in bundled:
+                s3.copy_file_to_object(os.path.join(opts['wsdir'], output),
+                                       "{}/{}".format(opts['outbucket'],
+                                                      output),
+                                       region=opts['region'])
+        s3.write_object(phase_manifest(opts, phase),
+                        json.dumps({'phase': phase, 'outputs': bundled,
+                                    'bundle': name}),
+                        region=opts['region'])
+        return
 
-def put_buckets(opts):
-    """Copy container output to bucket."""
+    def put_output(name):
+        """Copy an output file (or directory) to the output bucket"""
 
-    s3.sync_directory_to_bucket(opts['wsdir'], opts['outbucket'])
+        filename = os.path.join(opts['wsdir'], name)
+        path = "{}/{}".format(opts['outbucket'], name)
+        if os.path.isdir(filename):
+            s3.sync_directory_to_bucket(filename, path, quiet=True)
+        else:
+            s3.copy_file_to_object(filename, path, region=opts['region'])
+
+    s3.concurrently(put_output, outputs)
+    s3.write_object(phase_manifest(opts, phase),
+                    json.dumps({'phase': phase, 'outputs': outputs}),
+                    region=opts['region'])
+
+################################################################
+# Overlapped phases
+#
+# With the overlap option, all phases start together.  Each phase
+# installs packages and copies its source right away, then waits for
+# the phases it depends on to set their locks before copying its
+# inputs and running.  Each phase sets its lock when it finishes,
+# recording whether it succeeded.  A phase whose container dies (runs
+# out of memory, fails to start, or is cancelled) never sets its lock,
+# so a waiting phase also checks the Batch job for the phase it waits
+# on, described by the job id that cbmc-batch passes in the options,
+# and gives up once that job has failed.
+
+# Seconds between checks of the Batch job for a phase being waited on
+PHASE_JOB_INTERVAL = 60
+
+PHASE_LOCK = {
+    'build': lock.BUILD,
+    'property': lock.PROPERTY,
+    'coverage': lock.COVERAGE,
+    'report': lock.REPORT
+}
+
+def phase_locks(opts):
+    """The locks for the phases of the job"""
+
+    return lock.Lock(opts['lockbucket'], opts['region'],
+                     owner=opts['taskname'])
+
+class PhaseJob(object):
+    """The Batch job running a phase of the job"""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, opts, phase):
+        self.batch = Batch(region=opts['region'])
+        # The job running this phase is named jobname-phase
+        self.jobname = "{}-{}".format(opts['jobname'].rsplit('-', 1)[0],
+                                      phase)
+        # The id of the job, if cbmc-batch submitted it with this job
+        self.jobid = opts['phase-jobids'].get(phase)
+        self.checked = None
+        self.failed = False
+
+    def has_failed(self):
+        """The job has failed (checked at most every PHASE_JOB_INTERVAL)"""
+
+        if self.failed:
+            return True
+        if self.jobid is None:
+            return False
+        now = time.time()
+        if (self.checked is not None and
+                now - self.checked < PHASE_JOB_INTERVAL):
+            return False
+        self.checked = now
+        self.failed = any(job['status'] == 'FAILED'
+                          for job in self.batch.describe_jobs([self.jobid]))
+        return self.failed
+
+def wait_for_phases(opts, phases):
+    """Wait for phases to finish."""
+
+    if not opts['overlap']:
+        return
+
+    locks = phase_locks(opts)
+    for phase in phases:
+        if not opts[phase]:
+            continue
+        print("Waiting for {} phase".format(phase))
+        sys.stdout.flush()
+        job = PhaseJob(opts, phase)
+        locks.wait_for(PHASE_LOCK[phase],
+                       lambda name, job=job: (locks.is_set(name) or
+                                              job.has_failed()),
+                       lock.INTERVAL, opts['overlap-bound'])
+        if job.failed and not locks.is_set(PHASE_LOCK[phase]):
+            abort("The {} phase job {} failed without finishing"
+                  .format(phase, job.jobname))
+        holder = locks.holder(PHASE_LOCK[phase])
+        if holder is None:
+            abort("The {} phase lock was unset while waiting".format(phase))
+        # A lock set without a status (by hand) means the phase succeeded
+        if holder['status'] not in [None, lock.SUCCEEDED]:
+            abort("The {} phase failed".format(phase))
+
+def run_phase(opts, phase, launch):
+    """Run a phase, and set its lock when it finishes if overlapped."""
+
+    if not opts['overlap']:
+        launch(opts)
+        return
+
+    status = lock.FAILED
+    try:
+        launch(opts)
+        status = lock.SUCCEEDED
+    finally:
+        phase_locks(opts).set(PHASE_LOCK[phase], status)
 
 def checkpoint_file(filename, fileobj, s3path, region):
     """Write a checkpoint of an open file to a bucket"""
@@ -82,13 +293,41 @@ def checkpoint_file(filename, fileobj, s3path, region):
     s3.copy_file_to_object(
         ckptname, "{}/{}".format(s3path, ckptname), region=region)
 
-def checkpoint_performance(logfile, s3path, taskname, region):
-    """Write performance information to a logfile in a bucket"""
+def process_tree(pid):
+    """The pids of the process pid and all of its descendants"""
+
+    children = {}
+    output = subprocess.check_output(['ps', '-eo', 'pid=,ppid='],
+                                     universal_newlines=True)
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            children.setdefault(fields[1], []).append(fields[0])
+
+    tree = set()
+    pids = [str(pid)]
+    while pids:
+        pid = pids.pop()
+        if pid not in tree:
+            tree.add(pid)
+            pids.extend(children.get(pid, []))
+    return tree
+
+def checkpoint_performance(logfile, s3path, taskname, region, pid=None):
+    """Write performance information to a logfile in a bucket
+
+    The information is for the cbmc processes run by the process with
+    the given pid (the property and coverage phases of a fused job run
+    cbmc concurrently), or for any cbmc process if no pid is given.
+    """
+
+    # pylint: disable=too-many-arguments
 
     gmt = time.gmtime()
     timestamp = ("{:04d}{:02d}{:02d}-{:02d}{:02d}{:02d}"
                  .format(gmt.tm_year, gmt.tm_mon, gmt.tm_mday,
                          gmt.tm_hour, gmt.tm_min, gmt.tm_sec))
+    tree = process_tree(pid) if pid is not None else None
     output = subprocess.check_output(['ps', 'ux'])
     cbmc_ps_line = None
     with open(logfile, "a") as logobj:
@@ -97,8 +336,11 @@ def checkpoint_performance(logfile, s3path, taskname, region):
             if 'USER' in line:
                 logobj.write(line[:80]+'\n')
             elif 'cbmc' in line:
+                fields = line.split()
+                if tree is not None and fields[1] not in tree:
+                    continue
                 logobj.write(line[:80]+'\n')
-                cbmc_ps_line = line.split()
+                cbmc_ps_line = fields
     s3.copy_file_to_object(
         logfile, "{}/{}".format(s3path, logfile), region=region)
 
@@ -160,56 +402,84 @@ def run_command(command, outfile, errfile, psfile, opts, delay=10):
         popen = subprocess.Popen(command, universal_newlines=True,
                                  stdout=outobj, stderr=errobj)
 
-        path = opts['outbucket']
-        taskname = opts['taskname']
-        region = opts['region']
-        while popen.poll() is None:
-            checkpoint_file(outfile, outobj, path, region)
-            checkpoint_file(errfile, errobj, path, region)
-            checkpoint_performance(psfile, path, taskname, region)
+        while True:
+            # wait4 and not poll to get the resource usage of the command
+            (pid, status, usage) = os.wait4(popen.pid, os.WNOHANG)
+            if pid == popen.pid:
+                break
+            checkpoint_file(outfile, outobj, opts['outbucket'], opts['region'])
+            checkpoint_file(errfile, errobj, opts['outbucket'], opts['region'])
+            checkpoint_performance(psfile, opts['outbucket'], opts['taskname'],
+                                   opts['region'], popen.pid)
             time.sleep(delay)
+        popen.returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                            else -os.WTERMSIG(status))
 
     print("Command returned error code {}: {}".format(popen.returncode,
                                                       ' '.join(command)))
     os.chdir(cwd)
 
-def launch_build(opts):
-    """Launch the build step"""
+    # Linux reports maximum resident set size in kilobytes
+    return (popen.returncode, usage.ru_maxrss / 1024.0)
+
+def put_result(opts, returncode, peak_memory):
+    """Write the summary of the CBMC results and publish it as metrics"""
+
+    result = cbmcresult.summarize(os.path.join(opts['wsdir'], 'cbmc.txt'),
+                                  returncode, peak_memory)
+    cbmcresult.write(result,
+                     os.path.join(opts['wsdir'], cbmcresult.RESULT_JSON))
+    print("CBMC result: {}".format(json.dumps(result)))
+
+    metrics = [('Failed properties', len(result['failed-properties']), 'None'),
+               ('Solver time', result['solver-time'], 'Seconds'),
+               ('VCCs', result['vccs'], 'None'),
+               ('Peak memory [MB]', result['peak-memory'], 'Megabytes')]
+    taskname = opts['taskname']
+    client = boto3.client('cloudwatch', region_name=opts['region'])
+    client.put_metric_data(
+        Namespace='CBMC-Batch',
+        MetricData=[
+            {
+                'MetricName': name,
+                'Dimensions': [{'Name': 'Job', 'Value': taskname}],
+                'Value': float(value),
+                'Unit': unit
+            }
+            for (name, value, unit) in metrics if value is not None
+        ])
+
+def run_build(opts):
+    """Run the build step"""
 
-    install_cbmc(opts)
-    get_buckets(opts)
     print("Launching Build")
     cmd = ['make', 'goto']
     run_command(cmd, 'build.txt', 'build-err.txt', 'build-ps.txt', opts)
     print("Finished Build")
-    put_buckets(opts)
 
-def launch_property(opts):
-    """Launch the property step"""
+def run_property(opts):
+    """Run the property step"""
 
-    install_cbmc(opts)
-    get_buckets(opts, copysrc=False)
     print("Launching Property")
 
     cmd = ['cbmc', opts['goto']]
     cmd += options.options_dict2words(opts['cbmcflags'])
     cmd += ['--trace']
-    run_command(cmd, 'cbmc.txt', 'cbmc-err.txt', 'cbmc-ps.txt', opts)
+    (returncode, peak_memory) = run_command(
+        cmd, 'cbmc.txt', 'cbmc-err.txt', 'cbmc-ps.txt', opts)
 
     cmd = ['cbmc', opts['goto']]
     cmd += options.options_dict2words(opts['cbmcflags'])
     cmd += ['--show-properties', '--xml-ui']
     run_command(cmd, 'property.xml', 'property-err.txt', 'property-ps.txt',
                 opts)
+    put_result(opts, returncode, peak_memory)
 
     print("Finished Property")
-    put_buckets(opts)
 
-def launch_coverage(opts):
-    """Launch the coverage step"""
+def run_coverage(opts):
+    """Run the coverage step"""
 
-    install_cbmc(opts)
-    get_buckets(opts, copysrc=False)
     print("Launching Coverage")
 
     cmd = ['cbmc', opts['goto']]
@@ -224,14 +494,10 @@ def launch_coverage(opts):
                 opts)
 
     print("Finished Coverage")
-    put_buckets(opts)
 
-def launch_report(opts):
-    """Launch the report step"""
+def run_report(opts):
+    """Run the report step"""
 
-    install_cbmc(opts)
-    install_viewer(opts)
-    get_buckets(opts)
     print("Launching Report")
 
     cmd = ['cbmc-viewer',
@@ -245,9 +511,12 @@ def launch_report(opts):
            '--json-summary', 'summary.json'
           ]
     run_command(cmd, 'report.txt', 'report-err.txt', 'report-ps.txt', opts)
+    reportupload.publish_report(opts)
 
     print("Finished Report")
-    put_buckets(opts)
+
+def put_coverage(opts):
+    """Publish the coverage in the report summary as metrics"""
 
     summary = None
     with open(os.path.join(opts['wsdir'], 'summary.json'), 'r') as j:
@@ -279,6 +548,114 @@ def launch_report(opts):
             }
         ])
 
+################################################################
+
+def launch_build(opts):
+    """Launch the build step"""
+
+    container.install_cbmc(opts)
+    container.get_buckets(opts)
+    run_build(opts)
+    put_outputs(opts, 'build')
+
+def launch_property(opts):
+    """Launch the property step"""
+
+    container.install_cbmc(opts)
+    wait_for_phases(opts, ['build'])
+    get_inputs(opts, 'property')
+    run_property(opts)
+    put_outputs(opts, 'property')
+
+def launch_coverage(opts):
+    """Launch the coverage step"""
+
+    container.install_cbmc(opts)
+    wait_for_phases(opts, ['build'])
+    get_inputs(opts, 'coverage')
+    run_coverage(opts)
+    put_outputs(opts, 'coverage')
+
+def launch_report(opts):
+    """Launch the report step"""
+
+    container.install_cbmc(opts)
+    container.install_viewer(opts)
+    container.get_source(opts)
+    wait_for_phases(opts, ['property', 'coverage'])
+    get_inputs(opts, 'report')
+    run_report(opts)
+    put_outputs(opts, 'report')
+    put_coverage(opts)
+
+def launch_fused(opts):
+    """Launch all the steps in one container
+
+    The property and coverage steps run concurrently, and the buckets
+    are copied to and from the container only once.
+    """
+
+    container.install_cbmc(opts)
+    if opts['report']:
+        container.install_viewer(opts)
+    run_fused(opts)
+
+def run_fused(opts, copysrc=True):
+    """Run all the steps with the packages installed"""
+
+    container.get_buckets(opts, copysrc)
+
+    # Commands run in the workspace: stay there so that concurrent
+    # commands agree on the working directory
+    cwd = os.getcwd()
+    os.chdir(opts['wsdir'])
+    try:
+        if opts['build']:
+            run_build(opts)
+
+        steps = [run for (phase, run) in [('property', run_property),
+                                          ('coverage', run_coverage)]
+                 if opts[phase]]
+        pool = ThreadPool(max(len(steps), 1))
+        try:
+            results = [pool.apply_async(step, (opts,)) for step in steps]
+            for result in results:
+                result.get()
+        finally:
+            pool.close()
+            pool.join()
+
+        if opts['report']:
+            run_report(opts)
+    finally:
+        os.chdir(cwd)
+
+    for phase in ['build', 'property', 'coverage', 'report']:
+        if opts[phase]:
+            put_outputs(opts, phase)
+    if opts['report']:
+        put_coverage(opts)
+
+################################################################
+# Packs and workers
+
+def run_packed(opts):
+    """Run all the steps of one job in a pack (or for a worker), and write
+    its status"""
+
+    status = 'FAILED'
+    try:
+        run_fused(opts, copysrc=False)
+        status = 'SUCCEEDED'
+    except Exception: # pylint: disable=broad-except
+        traceback.print_exc()
+    sys.stdout.flush()
+
+    print("Pack job {} {}".format(opts['jobname'], status))
+    worker.put_status(opts, status)
+    return status
+
+################################################################
 
 def main():
     """Run the job"""
@@ -296,31 +673,33 @@ def main():
     pprint(opts)
 
     if more_than_one([opts['dobuild'], opts['doproperty'],
-                      opts['docoverage'], opts['doreport']]):
+                      opts['docoverage'], opts['doreport'], opts['dofused']]):
         print("Too many commands passed to docker container.")
         return
 
-    if opts['dobuild']:
+    if opts['dopack']:
+        print("docker doing pack")
+        worker.launch_pack(opts, run_packed)
+    elif opts['doworker']:
+        print("docker doing worker")
+        worker.launch_worker(opts, run_packed)
+    elif opts['dofused']:
+        print("docker doing fused")
+        launch_fused(opts)
+    elif opts['dobuild']:
         print("docker doing build")
-        launch_build(opts)
-        return
-
-    if opts['doproperty']:
+        run_phase(opts, 'build', launch_build)
+    elif opts['doproperty']:
         print("docker doing property")
-        launch_property(opts)
-        return
-
-    if opts['docoverage']:
+        run_phase(opts, 'property', launch_property)
+    elif opts['docoverage']:
         print("docker doing coverage")
-        launch_coverage(opts)
-        return
-
-    if opts['doreport']:
+        run_phase(opts, 'coverage', launch_coverage)
+    elif opts['doreport']:
         print("docker doing report")
-        launch_report(opts)
-        return
-
-    print("docker done")
+        run_phase(opts, 'report', launch_report)
+    else:
+        print("docker done")
 
 if __name__ == "__main__":
     main()
@@ -3,11 +3,16 @@
 
 """Locks to control the dependencies of a CBMC job in AWS Batch."""
 
+import os
 import re
+import socket
 import sys
+import time
 
 import boto3
+from botocore.exceptions import ClientError
 
+import clienterror
 import s3
 
 ################################################################
@@ -58,10 +63,53 @@ COVERAGE = 'coverage.txt'
 REPORT = 'report.txt'
 LOCKS = [BUILD, PROPERTY, COVERAGE, REPORT]
 
+# The status of the phase that set a lock
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# Waiting for a lock polls the lock with exponential backoff, starting
+# with BACKOFF_MIN seconds between polls and doubling up to the interval
+# given to the wait (INTERVAL by default).
+
+INTERVAL = 15
+BACKOFF_MIN = 0.5
+
+def default_owner():
+    """The owner of locks set or acquired by this process."""
+
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+def supports_conditional_puts(client):
+    """The S3 client accepts conditional puts (IfNoneMatch and IfMatch)
+
+    Conditional puts need a botocore from 2024 or later, and the boto3
+    installed in the python2 containers is older.
+    """
+
+    try:
+        operation = client.meta.service_model.operation_model('PutObject')
+        members = operation.input_shape.members
+    except Exception: # pylint: disable=broad-except
+        return False
+    return 'IfNoneMatch' in members and 'IfMatch' in members
+
 class Lock:
-    """A lock to control CBMC job dependencies."""
+    """A lock to control CBMC job dependencies.
+
+    A lock is an S3 object.  A lock can be set with a status (like
+    SUCCEEDED or FAILED), or acquired and released by an owner for a
+    lease.  The owner, the status, and the lease expiration time are
+    stored in the object metadata.
+
+    Acquiring a lock is atomic only if the S3 client supports
+    conditional puts: the lock object is created with a put that fails
+    if the object exists, unless the lease of the owner holding the
+    lock has expired.  With an older client, acquiring a lock reads the
+    lock and then writes it, and the lock is only advisory: two owners
+    racing for a free lock may both acquire it.
+    """
 
-    def __init__(self, path, region):
+    def __init__(self, path, region, owner=None):
 
         if not s3.is_path(path):
             raise LockException("Can't parse name as a bucket or an object: {}"
@@ -69,7 +117,9 @@ class Lock:
         self.bucket = s3.bucket_name(path)
         self.prefix = s3.key_name(path)
         self.locks = LOCKS
+        self.owner = owner or default_owner()
         self.client = boto3.client('s3', region_name=region)
+        self.atomic = supports_conditional_puts(self.client)
         if not s3.bucket_exists(self.bucket, client=self.client):
             raise LockException("Bucket does not exist: {}".format(self.bucket))
 
@@ -85,18 +135,27 @@ class Lock:
             return "{}/{}".format(self.bucket, lock)
         return "{}/{}/{}".format(self.bucket, self.prefix, lock)
 
+    def lock_key(self, lock):
+        """The object key for a lock"""
+
+        return s3.key_name(self.lock_path(lock))
+
     def validate_lock(self, lock):
         """Validate that lock is a known lock."""
 
         if lock not in self.locks:
             raise LockException("Unknown lock: {}".format(lock))
 
+    ################################################################
 
-    def set(self, lock):
-        """Set lock"""
+    def set(self, lock, status=None):
+        """Set lock (recording a status like SUCCEEDED or FAILED)"""
 
         self.validate_lock(lock)
-        s3.create_object(self.lock_path(lock), client=self.client)
+        if status is None:
+            s3.create_object(self.lock_path(lock), client=self.client)
+            return
+        self.put_lock(lock, {'owner': self.owner, 'status': status})
 
     def unset(self, lock):
         """Unset lock"""
@@ -116,20 +175,113 @@ class Lock:
         self.validate_lock(lock)
         return not s3.object_exists(self.lock_path(lock), client=self.client)
 
-    def wait_for_set(self, lock, interval=15, bound=None):
-        """Wait for lock to be set"""
+    ################################################################
+
+    def holder(self, lock):
+        """The owner, lease expiration time, status, and etag of a lock.
+
+        Return None if the lock is unset.
+        """
 
         self.validate_lock(lock)
-        attempts = (parse_bound(bound) // interval) + 1
-        s3.wait_for_object(self.lock_path(lock), client=self.client,
-                           interval=interval, attempts=attempts)
+        try:
+            response = self.client.head_object(Bucket=self.bucket,
+                                               Key=self.lock_key(lock))
+        except ClientError as exc:
+            if clienterror.is_not_found(exc):
+                return None
+            raise LockException("Error reading lock {}: {}"
+                                .format(lock, clienterror.code(exc)))
+        metadata = response.get('Metadata', {})
+        expires = metadata.get('expires')
+        return {'owner': metadata.get('owner'),
+                'expires': float(expires) if expires else None,
+                'status': metadata.get('status'),
+                'etag': response.get('ETag')}
+
+    def acquire(self, lock, lease=None):
+        """Acquire lock for a lease of the given duration (or forever)
+
+        Return True if the lock was acquired.  A lock held by another
+        owner can be acquired only after the lease has expired, and
+        acquiring a lock already held by this owner renews the lease.
+        """
 
-    def wait_for_unset(self, lock, interval=15, bound=None):
-        """Wait for lock to be unset"""
+        self.validate_lock(lock)
+        expires = time.time() + parse_bound(lease) if lease else None
+        metadata = {'owner': self.owner}
+        if expires:
+            metadata['expires'] = '{:.3f}'.format(expires)
+
+        if self.atomic and self.put_lock(lock, metadata, IfNoneMatch='*'):
+            return True
+
+        # The lock is held: take it over if the lease has expired
+        holder = self.holder(lock)
+        if holder is None:
+            if not self.atomic:
+                return self.put_lock(lock, metadata)
+            # Released since the put: try once more
+            return self.put_lock(lock, metadata, IfNoneMatch='*')
+        expired = (holder['expires'] is not None and
+                   holder['expires'] <= time.time())
+        if holder['owner'] != self.owner and not expired:
+            return False
+        if not self.atomic:
+            return self.put_lock(lock, metadata)
+        # Fails if the lock changed since it was read
+        return self.put_lock(lock, metadata, IfMatch=holder['etag'])
+
+    def put_lock(self, lock, metadata, **condition):
+        """Write a lock object if condition (if any) holds (True if written)"""
+
+        try:
+            self.client.put_object(Bucket=self.bucket,
+                                   Key=self.lock_key(lock),
+                                   Body=b'',
+                                   Metadata=metadata,
+                                   **condition)
+        except ClientError as exc:
+            if (clienterror.is_precondition_failed(exc) or
+                    clienterror.is_conditional_conflict(exc)):
+                return False
+            raise LockException("Error writing lock {}: {}"
+                                .format(lock, clienterror.code(exc)))
+        return True
+
+    def release(self, lock):
+        """Release lock if held by this owner (True if released)"""
+
+        holder = self.holder(lock)
+        if holder is None or holder['owner'] != self.owner:
+            return False
+        s3.delete_object(self.lock_path(lock), client=self.client)
+        return True
+
+    ################################################################
+
+    def wait_for(self, lock, condition, interval, bound):
+        """Wait for a condition to be true of a lock"""
 
         self.validate_lock(lock)
-        attempts = (parse_bound(bound) // interval) + 1
-        s3.wait_for_no_object(self.lock_path(lock), client=self.client,
-                              interval=interval, attempts=attempts)
+        deadline = time.time() + parse_bound(bound)
+        delay = min(BACKOFF_MIN, interval)
+        while not condition(lock):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise LockException("Timed out waiting for lock: {}"
+                                    .format(self.lock_path(lock)))
+            time.sleep(min(delay, remaining))
+            delay = min(2 * delay, interval)
+
+    def wait_for_set(self, lock, interval=INTERVAL, bound=None):
+        """Wait for lock to be set"""
+
+        self.wait_for(lock, self.is_set, interval, bound)
+
+    def wait_for_unset(self, lock, interval=INTERVAL, bound=None):
+        """Wait for lock to be unset"""
+
+        self.wait_for(lock, self.is_unset, interval, bound)
 
 ################################################################
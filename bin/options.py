@@ -36,6 +36,7 @@ def batch_options():
     parser = cbmcflags_parser(parser)
     parser = build_parser(parser)
     parser = aws_batch_parser(parser)
+    parser = queue_parser(parser)
     parser = other_parser(parser)
     parser = config_parser(parser)
 
@@ -51,6 +52,7 @@ def batch_options():
     opts = phase_merge(opts, args, config)
     opts = cbmcflags_merge(opts, args, config)
     opts = build_merge(opts, args, config)
+    opts = queue_merge(opts, args, config)
     opts = other_merge(opts, args, config)
 
     return opts
@@ -101,6 +103,7 @@ def docker_options():
     parser = cbmcflags_parser(parser)
     parser = build_parser(parser)
     parser = aws_batch_parser(parser)
+    parser = queue_parser(parser)
     parser = container_parser(parser)
     parser = config_parser(parser)
 
@@ -115,6 +118,7 @@ def docker_options():
     opts = package_merge(opts, args, config)
     opts = cbmcflags_merge(opts, args, config)
     opts = build_merge(opts, args, config)
+    opts = queue_merge(opts, args, config)
     opts = container_merge(opts, args, config)
 
     return opts
@@ -188,6 +192,8 @@ def bucket_parser(parser):
                         help='S3 path to bucket for output directory')
     parser.add_argument('--srctarfile', metavar="OBJ",
                         help='S3 path to tar file for source directory')
+    parser.add_argument('--lockbucket', metavar="BKT",
+                        help='S3 path to bucket for phase locks')
     return parser
 
 def bucket_merge(opts, args, config):
@@ -201,6 +207,8 @@ def bucket_merge(opts, args, config):
     opts['outbucket'] = (args.outbucket or config.get('outbucket', None) or
                          "{}/{}/out".format(opts['bucket'], opts['jobname']))
     opts['srctarfile'] = args.srctarfile or config.get('srctarfile', None)
+    opts['lockbucket'] = (args.lockbucket or config.get('lockbucket', None) or
+                          "{}/{}/lock".format(opts['bucket'], opts['jobname']))
 
     if not s3.is_path(opts['srcbucket']):
         abort("Not a valid S3 bucket or object: {}"
@@ -211,6 +219,9 @@ def bucket_merge(opts, args, config):
     if not s3.is_path(opts['outbucket']):
         abort("Not a valid S3 bucket or object: {}"
               .format(opts['outbucket']))
+    if not s3.is_path(opts['lockbucket']):
+        abort("Not a valid S3 bucket or object: {}"
+              .format(opts['lockbucket']))
 
     bkt = s3.bucket_name(opts['srcbucket'])
     if not s3.bucket_exists(bkt, region=opts['region']):
@@ -225,6 +236,7 @@ def bucket_merge(opts, args, config):
     opts['srcbucket'] = s3.path_url(opts['srcbucket'])
     opts['wsbucket'] = s3.path_url(opts['wsbucket'])
     opts['outbucket'] = s3.path_url(opts['outbucket'])
+    opts['lockbucket'] = s3.path_url(opts['lockbucket'])
 
     return opts
 
@@ -544,6 +556,14 @@ def container_parser(parser):
                         help='Do the CBMC coverage phase')
     parser.add_argument('--doreport', action="store_true", default=None,
                         help='Do the CBMC report phase')
+    parser.add_argument('--dofused', action="store_true", default=None,
+                        help='Do all the CBMC phases')
+    parser.add_argument('--dopack', action="store_true", default=None,
+                        help='Do all the CBMC phases for each job in a manifest')
+    parser.add_argument('--manifest', metavar='OBJ',
+                        help='S3 path to the manifest of jobs for --dopack')
+    parser.add_argument('--doworker', action="store_true", default=None,
+                        help='Do all the CBMC phases for each job in --queue')
 
     return parser
 
@@ -563,15 +583,42 @@ def container_merge(opts, args, config):
     opts['docoverage'] = merge(args.docoverage,
                                config.get('docoverage', None), False)
     opts['doreport'] = merge(args.doreport, config.get('doreport', None), False)
+    opts['dofused'] = merge(args.dofused, config.get('dofused', None), False)
+    opts['dopack'] = merge(args.dopack, config.get('dopack', None), False)
+    opts['manifest'] = merge(args.manifest, config.get('manifest', None), None)
+    opts['doworker'] = merge(args.doworker, config.get('doworker', None), False)
 
     if more_than_one_set([opts['dobuild'], opts['doproperty'],
-                          opts['docoverage'], opts['doreport']]):
+                          opts['docoverage'], opts['doreport'],
+                          opts['dofused'], opts['dopack'],
+                          opts['doworker']]):
         abort("Too many commands passed to docker container.")
+    if opts['dopack'] and not opts['manifest']:
+        abort("No manifest passed to docker container with --dopack.")
+    if opts['doworker'] and not opts['queue']:
+        abort("No queue passed to docker container with --doworker.")
+
+    # The phases of the job and how they overlap, from cbmc-batch
+    opts['build'] = merge(None, config.get('build', None), True)
+    opts['property'] = merge(None, config.get('property', None), True)
+    opts['coverage'] = merge(None, config.get('coverage', None), True)
+    opts['report'] = merge(None, config.get('report', None), True)
+    opts['overlap'] = merge(None, config.get('overlap', None), False)
+    opts['overlap-bound'] = merge(None, config.get('overlap-bound', None),
+                                  OVERLAP_BOUND)
+    opts['phase-jobids'] = merge(None, config.get('phase-jobids', None), {})
+    opts['bundle'] = merge(None, config.get('bundle', None), False)
+    opts['report-upload'] = merge(None, config.get('report-upload', None),
+                                  'tree')
 
     return opts
 
 ################################################################
 
+OVERLAP_BOUND = '6h'
+FUSED_THRESHOLD = None # Run each phase in its own container by default
+REPORT_UPLOADS = ['tree', 'archive', 'failures']
+
 def phase_parser(parser):
     """Parse options specific which cbmc phase to run."""
 
@@ -600,6 +647,58 @@ def phase_parser(parser):
                         action="store_false",
                         help="Don't the CBMC report phase")
 
+    parser.add_argument('--overlap', dest='overlap', default=None,
+                        action="store_true",
+                        help="""
+                        Start all phases together: each phase installs
+                        packages and copies inputs right away, and waits
+                        on the locks of the phases it depends on before
+                        running""")
+    parser.add_argument('--no-overlap', dest='overlap', default=None,
+                        action="store_false",
+                        help="Start each phase when the phases it depends "
+                        "on finish")
+    parser.add_argument('--fused', dest='fused', default=None,
+                        action="store_true",
+                        help="""
+                        Run all phases in one container, running the
+                        property and coverage phases concurrently
+                        (default: only for jobs needing at most the
+                        --fused-threshold memory, if one is given)""")
+    parser.add_argument('--no-fused', dest='fused', default=None,
+                        action="store_false",
+                        help="Run each phase in its own container")
+    parser.add_argument('--fused-threshold', metavar='MB',
+                        help="""
+                        Run all phases in one container if no phase needs
+                        more than this memory in MB
+                        (default: none, run each phase in its own
+                        container)""")
+    parser.add_argument('--overlap-bound', metavar='BOUND',
+                        help="""
+                        With --overlap, the time a phase waits for the
+                        phases it depends on, written as [wd][xh][ym][zs]
+                        (default: {})""".format(OVERLAP_BOUND))
+
+    parser.add_argument('--bundle', dest='bundle', default=None,
+                        action="store_true",
+                        help="""
+                        Store the outputs of each phase as one bundle
+                        (a zip archive) instead of one object per file""")
+    parser.add_argument('--no-bundle', dest='bundle', default=None,
+                        action="store_false",
+                        help="Store the outputs of each phase as one "
+                        "object per file")
+
+    parser.add_argument('--report-upload', metavar='MODE',
+                        choices=REPORT_UPLOADS,
+                        help="""
+                        What the report phase copies to the output bucket:
+                        every file of the html report (tree), the report
+                        as one zip archive with an index page (archive),
+                        or an index page with just the pages for the failed
+                        properties (failures) (default: tree)""")
+
     parser.add_argument('--copysrc', dest='copysrc', default=None,
                         action="store_true",
                         help='Copy source directory to bucket')
@@ -632,6 +731,62 @@ def phase_merge(opts, args, config):
                             opts['build'] or opts['report'])
     opts['copyws'] = merge(args.copyws, config.get('copyws', None), True)
     opts['copyout'] = merge(args.copyout, config.get('copyout', None), False)
+    opts['overlap'] = merge(args.overlap, config.get('overlap', None), False)
+    opts['overlap-bound'] = merge(args.overlap_bound,
+                                  config.get('overlap-bound', None),
+                                  OVERLAP_BOUND)
+    opts['fused'] = merge(args.fused, config.get('fused', None), None)
+    opts['bundle'] = merge(args.bundle, config.get('bundle', None), False)
+    opts['report-upload'] = merge(args.report_upload,
+                                  config.get('report-upload', None), 'tree')
+    if opts['report-upload'] not in REPORT_UPLOADS:
+        abort("Not a valid report upload: {}".format(opts['report-upload']))
+    opts['fused-threshold'] = merge(args.fused_threshold,
+                                    config.get('fused-threshold', None),
+                                    FUSED_THRESHOLD)
+    if opts['fused-threshold'] is not None:
+        opts['fused-threshold'] = int(opts['fused-threshold'])
+
+    return opts
+
+################
+# Options for the queue of tasks served by long-lived workers
+
+WORKER_IDLE = 300
+
+def queue_parser(parser):
+    """Parse options for the queue of tasks served by workers"""
+
+    parser.add_argument('--queue', metavar='QUEUE',
+                        help="""
+                        Add a job run in one container (see --fused) to
+                        this queue as a task instead of submitting it to
+                        AWS Batch: an SQS queue url, sqs://name, or a
+                        local directory""")
+    parser.add_argument('--workers', metavar='N',
+                        help="""
+                        Also submit N jobs running workers serving the
+                        queue, each with the memory to run any job
+                        queued (only jobs run in one container are
+                        queued)""")
+    parser.add_argument('--worker-idle', metavar='SECONDS',
+                        help="""
+                        The time a worker waits for a task before exiting,
+                        or 0 to wait forever (default: {})"""
+                        .format(WORKER_IDLE))
+    return parser
+
+def queue_merge(opts, args, config):
+    """Merge options for the queue of tasks served by workers"""
+
+    opts['queue'] = merge(args.queue, config.get('queue', None), None)
+    opts['workers'] = int(merge(args.workers, config.get('workers', None), 0))
+    opts['worker-idle'] = int(merge(args.worker_idle,
+                                    config.get('worker-idle', None),
+                                    WORKER_IDLE))
+
+    if opts['workers'] and not opts['queue']:
+        abort("Must specify --queue with --workers")
 
     return opts
 
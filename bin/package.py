@@ -3,10 +3,13 @@
 
 """Copy and install packages from S3 into a docker container"""
 
+import json
 import sys
 import subprocess
 import os
 
+import s3
+
 def abort(msg):
     """Abort package installation or launch"""
     raise RuntimeError(msg)
@@ -60,3 +63,60 @@ def launch(bindir, script, options):
         raise exc
 
 ################################################################
+# Packages baked into the image
+#
+# An image can be built with the packages already installed (baked
+# in).  The image records the name and S3 ETag of each package baked
+# in, and a package is copied and installed only if the package
+# requested is not the package baked in.
+
+BAKED = '/baked.json'
+
+def baked_packages():
+    """The packages baked into the image"""
+
+    try:
+        with open(BAKED) as baked_file:
+            return json.load(baked_file)
+    except (IOError, ValueError):
+        return {}
+
+def is_baked(pkg, bkt, tar, region=None):
+    """Test that package pkg from bucket bkt in file tar is baked in"""
+
+    baked = baked_packages().get(pkg)
+    if not baked or baked.get('package') != tar:
+        return False
+    etag = s3.object_etag('{}/{}'.format(bkt, tar), region=region)
+    return etag is not None and etag == baked.get('etag')
+
+def copy_and_install(pkg, bkt, tar, bindir, region=None):
+    """Copy and install package pkg unless the same package is baked in"""
+
+    if is_baked(pkg, bkt, tar, region):
+        print("Using package {} baked into image ({})".format(pkg, tar))
+        sys.stdout.flush()
+        return
+    copy(pkg, bkt, tar)
+    install(pkg, tar, bindir)
+
+def run(bindir, module, options):
+    """Run the main method of module in bindir with options
+
+    The module runs in this interpreter.  Modules of the same name
+    already loaded (from the boot directory, say) are unloaded first,
+    so the module runs with the modules in bindir.
+    """
+
+    bindir = os.path.abspath(bindir)
+    for name in list(sys.modules):
+        if os.path.exists(os.path.join(bindir, name + '.py')):
+            del sys.modules[name]
+    sys.path.insert(0, bindir)
+    sys.argv = [os.path.join(bindir, module + '.py')] + options
+
+    print("Running {} with '{}'".format(module, " ".join(sys.argv)))
+    sys.stdout.flush()
+    __import__(module).main()
+
+################################################################
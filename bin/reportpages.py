@@ -0,0 +1,130 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""The pages of the cbmc-viewer html report for the failed properties.
+
+The report index written by cbmc-viewer lists each failed property
+with a link to its trace.  The pages for the failed properties are the
+trace pages the index links to for those properties, together with the
+files these pages need: the source pages the traces link to, and the
+style sheets, scripts, and images of every page selected.
+"""
+
+import os
+import re
+
+try:
+    from html.parser import HTMLParser
+except ImportError: # python2
+    from HTMLParser import HTMLParser
+
+################################################################
+
+INDEX = 'index.html'
+
+# Attributes naming the files a page needs to be displayed
+ASSETS = [('link', 'href'), ('script', 'src'), ('img', 'src')]
+
+class Links(HTMLParser):
+    """The links in a page, and the text and links of each list item"""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.anchors = []
+        self.assets = []
+        self.items = []
+        self.open_items = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'li':
+            self.open_items.append({'text': [], 'anchors': []})
+            self.items.append(self.open_items[-1])
+        if tag == 'a' and attrs.get('href'):
+            self.anchors.append(attrs['href'])
+            if self.open_items:
+                self.open_items[-1]['anchors'].append(attrs['href'])
+        for (asset_tag, attr) in ASSETS:
+            if tag == asset_tag and attrs.get(attr):
+                self.assets.append(attrs[attr])
+
+    def handle_endtag(self, tag):
+        if tag == 'li' and self.open_items:
+            self.open_items.pop()
+
+    def handle_data(self, data):
+        if self.open_items:
+            self.open_items[-1]['text'].append(data)
+
+def parse(path):
+    """The links in the page at path"""
+
+    parser = Links()
+    with open(path) as page:
+        parser.feed(page.read())
+    parser.close()
+    return parser
+
+def local_file(htmldir, page, href):
+    """The file in htmldir a link in page refers to (or None)
+
+    Links to other sites, to absolute paths, and to files missing from
+    htmldir refer to no file in the report.
+    """
+
+    href = re.split('[#?]', href)[0]
+    if not href or ':' in href or href.startswith('/'):
+        return None
+    path = os.path.normpath(os.path.join(os.path.dirname(page), href))
+    if path.startswith('..'):
+        return None
+    if not os.path.isfile(os.path.join(htmldir, path)):
+        return None
+    return path
+
+def trace_pages(htmldir, properties):
+    """The trace pages the report index links to for properties
+
+    A trace page is a link to a page in the list item naming the
+    property in the index.
+    """
+
+    index = parse(os.path.join(htmldir, INDEX))
+    pages = []
+    for item in index.items:
+        words = set(re.split(r'[\s:,()]+', ''.join(item['text'])))
+        if not words & set(properties):
+            continue
+        for href in item['anchors']:
+            path = local_file(htmldir, INDEX, href)
+            if (path and path.endswith('.html') and path != INDEX and
+                    path not in pages):
+                pages.append(path)
+    return pages
+
+def failure_files(htmldir, properties):
+    """The files in htmldir needed to view the failed properties
+
+    The files are the index, the trace pages for properties, the pages
+    the trace pages link to, and the assets of all of these pages,
+    given as paths relative to htmldir.  Other links in the source
+    pages lead to files that are not included.
+    """
+
+    if not os.path.isfile(os.path.join(htmldir, INDEX)):
+        return []
+
+    traces = trace_pages(htmldir, properties)
+    files = [INDEX] + traces
+    for trace in traces:
+        for href in parse(os.path.join(htmldir, trace)).anchors:
+            path = local_file(htmldir, trace, href)
+            if path and path not in files:
+                files.append(path)
+
+    for page in [path for path in files if path.endswith('.html')]:
+        for href in parse(os.path.join(htmldir, page)).assets:
+            path = local_file(htmldir, page, href)
+            if path and path not in files:
+                files.append(path)
+    return files
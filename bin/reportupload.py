@@ -0,0 +1,144 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""What the report phase uploads of the cbmc-viewer html report.
+
+The html report is a tree of files, often thousands of them.  The
+report upload option chooses what the report phase copies to the
+output bucket: every file of the tree, the tree as one zip archive,
+or just the pages for the failed properties.  The last two also
+write a small index page summarizing the results and linking to
+what was copied.  With the bundle option, the index page links to the
+bundle of the report phase outputs, and it is copied as an object of
+its own next to the bundle so that a link can open it.
+"""
+
+import json
+import os
+
+import bundle
+import cbmcresult
+import reportpages
+import s3
+
+################################################################
+
+REPORT_ARCHIVE = 'report.zip'
+REPORT_INDEX = 'report.html'
+REPORT_LOGS = ['summary.json', 'report.txt', 'report-err.txt', 'report-ps.txt']
+
+# Outputs copied as objects of their own with the bundle option
+UNBUNDLED = [REPORT_INDEX]
+
+def read_json(opts, name):
+    """Read a json file in the workspace (None if there is none)"""
+
+    path = os.path.join(opts['wsdir'], name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as jfile:
+        return json.load(jfile)
+
+def failed_properties(opts):
+    """The properties that failed"""
+
+    result = read_json(opts, cbmcresult.RESULT_JSON) or {}
+    return result.get('failed-properties', [])
+
+def failure_pages(opts):
+    """The files of the report needed to view the failed properties
+
+    These are the report index, the trace pages the index links to for
+    the failed properties, and the source pages and assets they use.
+    """
+
+    htmldir = os.path.join(opts['wsdir'], 'html')
+    return [os.path.join('html', path) for path in
+            reportpages.failure_files(htmldir, failed_properties(opts))]
+
+def failure_traces(opts):
+    """The trace pages of the report for the failed properties"""
+
+    htmldir = os.path.join(opts['wsdir'], 'html')
+    if not os.path.isfile(os.path.join(htmldir, reportpages.INDEX)):
+        return []
+    return [os.path.join('html', path) for path in
+            reportpages.trace_pages(htmldir, failed_properties(opts))]
+
+def report_outputs(opts):
+    """The files the report phase copies to the output bucket"""
+
+    if opts['report-upload'] == 'archive':
+        outputs = [REPORT_ARCHIVE]
+    elif opts['report-upload'] == 'failures':
+        outputs = failure_pages(opts)
+    else:
+        outputs = ['html']
+    if opts['bundle'] or opts['report-upload'] != 'tree':
+        outputs = [REPORT_INDEX] + outputs
+    return outputs + REPORT_LOGS
+
+def escape(text):
+    """Escape text for an html page"""
+
+    return (str(text).replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;').replace('"', '&quot;'))
+
+def write_report_index(opts, links, note=None):
+    """Write the index page summarizing the results of the job"""
+
+    result = read_json(opts, cbmcresult.RESULT_JSON) or {}
+    summary = read_json(opts, 'summary.json') or {}
+    coverage = (summary.get('coverage') or {}).get('statically-reachable')
+
+    title = "CBMC report for {}".format(escape(opts['jobname']))
+    page = ["<html>",
+            "<head><title>{}</title></head>".format(title),
+            "<body>",
+            "<h1>{}</h1>".format(title),
+            "<p>Verdict: {}</p>".format(escape(result.get('verdict')))]
+    if coverage:
+        page.append("<p>Coverage: {} of {} reachable lines</p>"
+                    .format(coverage.get('hit'), coverage.get('lines')))
+    page.append("<h2>Failed properties</h2>")
+    page.append("<ul>")
+    page += ["<li>{}</li>".format(escape(prop))
+             for prop in result.get('failed-properties', [])]
+    page.append("</ul>")
+    page.append("<h2>Report</h2>")
+    page.append("<ul>")
+    page += ['<li><a href="{}">{}</a></li>'.format(escape(href), escape(text))
+             for (href, text) in links]
+    page.append("</ul>")
+    if note:
+        page.append("<p>{}</p>".format(escape(note)))
+    page += ["</body>", "</html>"]
+
+    with open(os.path.join(opts['wsdir'], REPORT_INDEX), 'w') as index:
+        index.write('\n'.join(page) + '\n')
+
+def publish_report(opts):
+    """Write the report archive and index page for the report upload"""
+
+    if opts['report-upload'] == 'archive':
+        if os.path.isdir(os.path.join(opts['wsdir'], 'html')):
+            bundle.write(opts['wsdir'], ['html'],
+                         os.path.join(opts['wsdir'], REPORT_ARCHIVE))
+
+    if opts['bundle']:
+        name = bundle.bundle_name('report')
+        write_report_index(
+            opts, [(name, "The report phase outputs (a zip archive "
+                    "holding the report)")],
+            "List or extract the report with: bundle.py {}/{} --extract DIR"
+            .format(s3.path_url(opts['outbucket']), name))
+    elif opts['report-upload'] == 'archive':
+        write_report_index(opts, [(REPORT_ARCHIVE, "The full report "
+                                   "(a zip archive of the html report)")])
+    elif opts['report-upload'] == 'failures':
+        pages = [os.path.join('html', 'index.html')] + failure_traces(opts)
+        write_report_index(
+            opts, [(page, page) for page in pages],
+            "Only the report index and the pages for the failed properties "
+            "(their traces and the source pages the traces link to) were "
+            "uploaded.  Other links in these pages are unavailable.")
@@ -11,6 +11,7 @@ import re
 import sys
 import errno
 from pprint import pprint
+from multiprocessing.pool import ThreadPool
 
 import boto3
 from botocore.exceptions import ClientError
@@ -148,6 +149,30 @@ def object_url(path):
         return None
     return path_url(path)
 
+################################################################
+# Concurrency
+#
+# S3 requests spend most of their time waiting on the network, so
+# methods operating on many paths issue their requests from a pool of
+# threads.  Boto3 clients (but not sessions) are thread safe, so the
+# threads share one client.  Python3 callers can use the asyncio
+# versions of these methods in s3aio.
+
+THREADS = 16
+
+def concurrently(func, items, threads=THREADS):
+    """Apply func to the items in a pool of threads (results in order)."""
+
+    items = list(items)
+    if not items:
+        return []
+    pool = ThreadPool(min(threads, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
 ################################################################
 # Testing for existence
 
@@ -202,6 +227,35 @@ def object_exists(path, client=None, region=None):
         return False
     return True
 
+def object_etag(path, client=None, region=None):
+    """The ETag of an object (or None if the object does not exist)"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    if not is_object(path):
+        return None
+
+    try:
+        response = client.head_object(Bucket=bucket_name(path),
+                                      Key=key_name(path))
+    except ClientError as exc:
+        if clienterror.is_not_found(exc):
+            return None
+        if clienterror.is_forbidden(exc):
+            return None
+        abort("Error reading object ETag", path, data=exc)
+    return response.get('ETag')
+
+def exists_many(paths, client=None, region=None, threads=THREADS):
+    """Test that each path names a bucket or object that exists."""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    return concurrently(lambda path: path_exists(path, client, region),
+                        paths, threads)
+
 ################################################################
 # Creation
 #
@@ -291,6 +345,64 @@ def copy_object_to_file(objectname, filename, client=None, region=None):
         abort("Error copying object {} to file {}".format(objectname, filename),
               "", data=exc)
 
+def write_object(path, body, client=None, region=None):
+    """Write a string to an S3 object"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    if not is_object(path):
+        abort("Not an object name", path)
+
+    try:
+        client.put_object(Bucket=bucket_name(path), Key=key_name(path),
+                          Body=body)
+    except ClientError as exc:
+        abort("Error writing object", path, data=exc)
+
+def read_object(path, client=None, region=None):
+    """Read a string from an S3 object"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    if not is_object(path):
+        abort("Not an object name", path)
+
+    try:
+        response = client.get_object(Bucket=bucket_name(path),
+                                     Key=key_name(path))
+    except ClientError as exc:
+        abort("Error reading object", path, data=exc)
+    return response['Body'].read().decode('utf-8')
+
+def copy_object(source, destination, client=None, region=None):
+    """Copy an S3 object to an S3 object (within S3)"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    if not is_object(source):
+        abort("Not an object name", source)
+    if not is_object(destination):
+        abort("Not an object name", destination)
+
+    try:
+        client.copy({'Bucket': bucket_name(source), 'Key': key_name(source)},
+                    bucket_name(destination), key_name(destination))
+    except ClientError as exc:
+        abort("Error copying object {} to object {}"
+              .format(source, destination), "", data=exc)
+
+def copy_many(pairs, client=None, region=None, threads=THREADS):
+    """Copy S3 objects to S3 objects given (source, destination) pairs"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    concurrently(lambda pair: copy_object(pair[0], pair[1], client, region),
+                 pairs, threads)
+
 ################################################################
 # Deletion
 #
@@ -361,38 +473,69 @@ def delete_object(path, recursive=False, client=None, region=None,
         abort("No such bucket", path)
 
     if recursive:
-        while True:
-            try:
-                response = client.list_objects(Bucket=bucket, Prefix=prefix)
-            except ClientError as exc:
-                # not to fail here can induce an infinite loop
-                abort("Error deleting objects", path,
-                      data=exc, verbose=not quiet)
-
-            objects = response.get('Contents', None)
-            if objects is None:
-                break
-
-            for obj in objects:
-                key = obj.get('Key', None)
-                if key is None:
-                    # not to fail here can induce an infinite loop
-                    abort("Error deleting objects", path, data=obj,
-                          verbose=not quiet)
-                if not quiet:
-                    print("Deleting object {}".format(key))
-                try:
-                    client.delete_object(Bucket=bucket, Key=key)
-                except ClientError as exc:
-                    # deleting a nonexistent object does not generate an error
-                    abort("Error deleting object", key,
-                          data=exc, verbose=not quiet)
+        delete_prefix(path, client=client, region=region, quiet=quiet)
     else:
         try:
-            response = client.delete_object(Bucket=bucket, Key=prefix)
+            client.delete_object(Bucket=bucket, Key=prefix)
         except ClientError as exc:
             # deleting a nonexistent object does not generate an error
-            abort("Error deleting object", key, data=exc, verbose=not quiet)
+            abort("Error deleting object", prefix, data=exc, verbose=not quiet)
+
+DELETE_MAX = 1000 # Maximum number of keys deleted by one request
+
+def list_keys(path, client=None, region=None):
+    """Generate the keys under a path, one page of keys at a time."""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    if not is_path(path):
+        abort("Not a bucket or object name", path)
+    bucket = bucket_name(path)
+    prefix = key_name(path) or ""
+
+    try:
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            yield [obj['Key'] for obj in page.get('Contents', [])]
+    except ClientError as exc:
+        abort("Error listing objects", path, data=exc)
+
+def delete_keys(bucket, keys, client=None, region=None, quiet=True):
+    """Delete objects from a bucket (at most DELETE_MAX keys)"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    if not keys:
+        return
+    if not quiet:
+        for key in keys:
+            print("Deleting object {}".format(key))
+
+    try:
+        response = client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+    except ClientError as exc:
+        abort("Error deleting objects", bucket, data=exc, verbose=not quiet)
+    # deleting a nonexistent object does not generate an error
+    if response.get('Errors'):
+        abort("Error deleting objects", bucket, data=response['Errors'],
+              verbose=not quiet)
+
+def delete_prefix(path, client=None, region=None, quiet=True, threads=THREADS):
+    """Delete everything underneath a path (a bucket or bucket and prefix)"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    bucket = bucket_name(path)
+    batches = [keys[start:start+DELETE_MAX]
+               for keys in list_keys(path, client, region)
+               for start in range(0, len(keys), DELETE_MAX)]
+    concurrently(lambda keys: delete_keys(bucket, keys, client, region, quiet),
+                 batches, threads)
 
 ################################################################
 # Synchronization
@@ -0,0 +1,140 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Asyncio versions of the methods for interacting with AWS S3.
+
+The coroutines run the blocking boto3 requests of the s3 methods in a
+pool of threads, so hundreds of S3 operations can be awaited together
+with asyncio.gather.  Use the method run to call a coroutine from
+synchronous code.
+
+This module requires python3.  The container runs python2, and uses
+the synchronous (thread pool) methods in s3 instead.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+
+import boto3
+
+import s3
+
+################################################################
+# Running blocking methods in threads
+
+THREADS = 32
+
+EXECUTOR = None
+
+def executor():
+    """The thread pool shared by the coroutines."""
+
+    global EXECUTOR # pylint: disable=global-statement
+    if EXECUTOR is None:
+        EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=THREADS)
+    return EXECUTOR
+
+async def offload(func, *args, **kwargs):
+    """Run a blocking method in the thread pool."""
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor(),
+                                      functools.partial(func, *args, **kwargs))
+
+def run(coroutine):
+    """Run a coroutine to completion from synchronous code."""
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def s3_client(client=None, region=None):
+    """A client shared by the threads (boto3 clients are thread safe)."""
+
+    return client or boto3.client('s3', region_name=region)
+
+################################################################
+# Testing for existence
+
+async def path_exists(path, client=None, region=None):
+    """Test that path names a bucket or object that exists."""
+
+    return await offload(s3.path_exists, path, s3_client(client, region),
+                         region)
+
+async def exists_many(paths, client=None, region=None):
+    """Test that each path names a bucket or object that exists."""
+
+    client = s3_client(client, region)
+    return await asyncio.gather(*[path_exists(path, client, region)
+                                  for path in paths])
+
+################################################################
+# Copying
+
+async def copy_object(source, destination, client=None, region=None):
+    """Copy an S3 object to an S3 object (within S3)"""
+
+    await offload(s3.copy_object, source, destination,
+                  s3_client(client, region), region)
+
+async def copy_many(pairs, client=None, region=None):
+    """Copy S3 objects to S3 objects given (source, destination) pairs"""
+
+    client = s3_client(client, region)
+    await asyncio.gather(*[copy_object(src, dst, client, region)
+                           for src, dst in pairs])
+
+################################################################
+# Deletion
+
+async def delete_prefix(path, client=None, region=None, quiet=True):
+    """Delete everything underneath a path (a bucket or bucket and prefix)
+
+    Each page of keys is deleted while the next page is listed.
+    """
+
+    client = s3_client(client, region)
+    bucket = s3.bucket_name(path)
+    pages = s3.list_keys(path, client, region)
+    deletions = []
+    while True:
+        keys = await offload(next, pages, None)
+        if keys is None:
+            break
+        for start in range(0, len(keys), s3.DELETE_MAX):
+            deletions.append(asyncio.ensure_future(offload(
+                s3.delete_keys, bucket, keys[start:start+s3.DELETE_MAX],
+                client, region, quiet)))
+    await asyncio.gather(*deletions)
+
+################################################################
+# Synchronization
+
+async def sync(directory, bucket, download=False, quiet=True, delete=False):
+    """Synchronize a directory to a path (a bucket or bucket and prefix).
+
+    Synchronize the path to the directory instead if download is True.
+    """
+    # pylint: disable=too-many-arguments
+
+    if download:
+        await offload(s3.sync_bucket_to_directory, bucket, directory,
+                      quiet, delete)
+    else:
+        await offload(s3.sync_directory_to_bucket, directory, bucket,
+                      quiet, delete)
+
+async def sync_many(pairs, download=False, quiet=True, delete=False):
+    """Synchronize directories and paths given (directory, path) pairs"""
+
+    await asyncio.gather(*[sync(directory, bucket, download, quiet, delete)
+                           for directory, bucket in pairs])
+
+################################################################
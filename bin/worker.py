@@ -0,0 +1,243 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Run many small jobs in one container: packs and workers.
+
+A pack runs the jobs listed in a manifest in a pool of processes, and
+a worker runs the jobs on a work queue one after another until the
+queue is idle.  Each job runs all of its steps (as a fused job), and
+writes its output and its status to its own output bucket.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import traceback
+
+import boto3
+
+import cbmc
+import container
+import s3
+import workqueue
+
+################################################################
+# Packs
+
+def container_cpus():
+    """The number of cpus available to the container"""
+
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as quota_file:
+            quota = int(quota_file.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as period_file:
+            period = int(period_file.read())
+        if quota > 0 and period > 0:
+            return max(1, quota // period)
+    except (IOError, ValueError):
+        pass
+    return multiprocessing.cpu_count()
+
+def container_memory():
+    """The memory limit of the container in MB (None if unknown)"""
+
+    for path in ['/sys/fs/cgroup/memory/memory.limit_in_bytes',
+                 '/sys/fs/cgroup/memory.max']:
+        try:
+            with open(path) as limit_file:
+                return int(limit_file.read()) // (1024 * 1024)
+        except (IOError, ValueError):
+            continue
+    return None
+
+def pack_slots(jobs):
+    """The number of jobs to run at once given the cpus and memory"""
+
+    slots = container_cpus()
+    memory = container_memory()
+    needed = max(cbmc.fused_memory(job) for job in jobs)
+    if memory and needed:
+        slots = min(slots, memory // needed)
+    return max(1, min(slots, len(jobs)))
+
+def put_status(opts, status):
+    """Write the status of a job in a pack (or for a worker)"""
+
+    s3.write_object("{}/{}".format(opts['outbucket'], cbmc.PACK_STATUS),
+                    json.dumps({'jobname': opts['jobname'], 'status': status}),
+                    region=opts['region'])
+
+def launch_pack(opts, run):
+    """Launch all the steps for each job in a manifest
+
+    The jobs run in a pool of processes (commands change the working
+    directory) sized to the cpus and memory of the container, and each
+    job writes its own output and status to its own output bucket.
+    Each job is run by run (a function of the job options returning
+    its status, like docker.run_packed).
+    The jobs share the packages installed for the pack, and jobs with
+    the same source share one copy of the source.
+    """
+
+    jobs = json.loads(s3.read_object(opts['manifest'], region=opts['region']))
+    for job in jobs:
+        # Every job runs all steps in the container
+        job.update({'dofused': True, 'overlap': False})
+
+    container.install_cbmc(opts)
+    if any(job['report'] for job in jobs):
+        container.install_viewer(opts)
+    sources = {}
+    for job in jobs:
+        source = (job['srctarfile'] or job['srcbucket'], job['srcdir'])
+        sources.setdefault(source, job)
+    for job in sources.values():
+        container.get_source(job)
+
+    slots = pack_slots(jobs)
+    print("Running {} jobs {} at a time".format(len(jobs), slots))
+    sys.stdout.flush()
+    pool = multiprocessing.Pool(slots)
+    try:
+        statuses = pool.map(run, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    for (job, status) in zip(jobs, statuses):
+        print("Pack job {} {}".format(job['jobname'], status))
+
+################################################################
+# Workers
+
+HEARTBEAT = 60 # The time between extensions of a running task (seconds)
+
+def install_packages(opts, installed):
+    """Install the packages a job needs that are not already installed"""
+
+    cbmcpkg = (opts['pkgbucket'], opts['cbmcpkg'])
+    if installed.get('cbmc') != cbmcpkg:
+        container.install_cbmc(opts)
+        installed['cbmc'] = cbmcpkg
+    viewerpkg = (opts['pkgbucket'], opts['viewerpkg'])
+    if opts['report'] and installed.get('cbmc-viewer') != viewerpkg:
+        container.install_viewer(opts)
+        installed['cbmc-viewer'] = viewerpkg
+
+def get_cached_source(opts, sources):
+    """Copy the source a job needs if not already copied
+
+    The sources map each source directory to the tar file last
+    unpacked there.  A source tar file is unpacked once, and the tree
+    unpacked from an older tar file is removed before a newer one is
+    unpacked in its place.  A source bucket is synced again (syncing
+    copies only what has changed).
+    """
+
+    srcdir = opts['srcdir']
+    if opts['srctarfile'] and sources.get(srcdir) == opts['srctarfile']:
+        return
+    if srcdir in sources and os.path.isdir(srcdir):
+        print("Removing source {} unpacked from {}"
+              .format(srcdir, sources[srcdir]))
+        shutil.rmtree(srcdir)
+    sources.pop(srcdir, None)
+    container.get_source(opts)
+    sources[srcdir] = opts['srctarfile']
+
+def run_task_process(run, task):
+    """Run a task in a worker's child process, exiting with its status"""
+
+    sys.exit(0 if run(task) == 'SUCCEEDED' else 1)
+
+def run_task(queue, run, task, receipt):
+    """Run a task in its own process, extending the task while it runs
+
+    Returns the exit code of the process: nonzero if the task failed.
+    """
+
+    process = multiprocessing.Process(target=run_task_process,
+                                      args=(run, task))
+    process.start()
+    while True:
+        process.join(HEARTBEAT)
+        if not process.is_alive():
+            break
+        queue.extend(receipt)
+    return process.exitcode
+
+def put_event(opts, status):
+    """Announce the end of a task run by a worker
+
+    The event has the form of the event AWS Batch sends at the end of
+    the fused job the task replaces, so the task is reported in the
+    same way.
+    """
+
+    detail = {'jobName': "{}-fused".format(opts['jobname']),
+              'jobQueue': opts['queue'],
+              'status': status}
+    client = boto3.client('events', region_name=opts['region'])
+    try:
+        response = client.put_events(Entries=[{
+            'Source': cbmc.WORKER_EVENT_SOURCE,
+            'DetailType': cbmc.WORKER_EVENT_TYPE,
+            'Detail': json.dumps(detail)}])
+    except Exception: # pylint: disable=broad-except
+        traceback.print_exc()
+        return
+    if response.get('FailedEntryCount'):
+        print("Failed to announce the end of job {}: {}"
+              .format(opts['jobname'], response['Entries']))
+
+def launch_worker(opts, run):
+    """Launch all the steps for each job in a queue until the queue is idle
+
+    Packages installed and sources copied for one task are kept for
+    the tasks that follow.  Each task runs in its own process (commands
+    change the working directory) and writes its output and status to
+    its own output bucket, as a job in a pack does, and the end of
+    each task is announced with an event.  Each task is run by run,
+    as a job in a pack is.
+    """
+
+    queue = workqueue.open_queue(opts['queue'], opts['region'])
+    installed = {}
+    sources = {}
+    idle = time.time()
+    print("Worker serving queue {}".format(opts['queue']))
+    sys.stdout.flush()
+    while True:
+        got = queue.get()
+        if got is None:
+            if (opts['worker-idle'] and
+                    time.time() > idle + opts['worker-idle']):
+                print("Worker idle for {} seconds".format(opts['worker-idle']))
+                return
+            continue
+
+        (task, receipt) = got
+        # Every task runs all steps in the container
+        task.update({'dofused': True, 'overlap': False})
+        print("Worker running job {}".format(task['jobname']))
+        sys.stdout.flush()
+        status = 'FAILED'
+        try:
+            install_packages(task, installed)
+            get_cached_source(task, sources)
+            if not run_task(queue, run, task, receipt):
+                status = 'SUCCEEDED'
+            else:
+                # The process may have died before writing the status
+                put_status(task, status)
+        except Exception: # pylint: disable=broad-except
+            traceback.print_exc()
+            put_status(task, status)
+        print("Worker job {} {}".format(task['jobname'], status))
+        sys.stdout.flush()
+        put_event(task, status)
+        queue.done(receipt)
+        idle = time.time()
@@ -0,0 +1,205 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Queues of tasks for long-lived workers.
+
+A task is a dictionary of options for the docker script.  A queue is
+either an SQS queue (named by its url, or by sqs://name) or a local
+directory of json files (a stand-in for SQS when testing).  A worker
+gets a task together with a receipt, extends the receipt while the
+task runs, and marks the task done with the receipt.  A task not
+marked done is delivered again once its receipt expires.
+"""
+
+import json
+import os
+import time
+import uuid
+from pprint import pprint
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+import clienterror
+
+################################################################
+
+class WorkQueueException(Exception):
+    """Exception thrown by work queue methods."""
+
+    def __init__(self, msg):
+        super(WorkQueueException, self).__init__()
+        self.message = msg
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return self.message
+
+################################################################
+
+DEBUGGING = True
+
+def abort(msg1, msg2=None, data=None, verbose=False):
+    """Abort a work queue method with debugging information."""
+    code = clienterror.code(data)
+    msgs = [msg1]
+    if code is not None:
+        msgs.append(" ({})".format(code))
+    if msg2 is not None:
+        msgs.append(": {}".format(msg2))
+    msg = ''.join(msgs)
+    if verbose or DEBUGGING:
+        print("WorkQueue Exception: {}".format(msg))
+        pprint(clienterror.response(data) or data)
+    raise WorkQueueException(msg)
+
+################################################################
+
+WAIT = 20 # The longest wait for a task in one call to get (seconds)
+TIMEOUT = 900 # The time a task is hidden from other workers (seconds)
+POLL = 1 # The time between polls of a local queue (seconds)
+
+def open_queue(name, region=None):
+    """The queue with the given name"""
+
+    if name.startswith('https://'):
+        return SQSQueue(name, region)
+    if name.startswith('sqs://'):
+        return SQSQueue(queue_url(name[len('sqs://'):], region), region)
+    return FileQueue(name)
+
+def queue_url(name, region=None):
+    """The url of the SQS queue with the given name"""
+
+    client = boto3.client('sqs', region_name=region)
+    try:
+        response = client.get_queue_url(QueueName=name)
+    except (ClientError, BotoCoreError) as exc:
+        abort("Can't find queue", name, exc)
+    return response['QueueUrl']
+
+################################################################
+
+class SQSQueue(object):
+    """A queue of tasks in SQS"""
+
+    def __init__(self, url, region=None):
+        self.url = url
+        self.client = boto3.client('sqs', region_name=region)
+
+    def put(self, task):
+        """Add a task to the queue"""
+
+        try:
+            self.client.send_message(QueueUrl=self.url,
+                                     MessageBody=json.dumps(task))
+        except (ClientError, BotoCoreError) as exc:
+            abort("Can't add task to queue", self.url, exc)
+
+    def get(self, wait=WAIT, timeout=TIMEOUT):
+        """Get a task and its receipt from the queue (or None)"""
+
+        try:
+            response = self.client.receive_message(
+                QueueUrl=self.url, MaxNumberOfMessages=1,
+                WaitTimeSeconds=wait, VisibilityTimeout=timeout)
+        except (ClientError, BotoCoreError) as exc:
+            abort("Can't get task from queue", self.url, exc)
+        messages = response.get('Messages')
+        if not messages:
+            return None
+        return (json.loads(messages[0]['Body']), messages[0]['ReceiptHandle'])
+
+    def extend(self, receipt, timeout=TIMEOUT):
+        """Keep a task hidden from other workers for timeout seconds"""
+
+        try:
+            self.client.change_message_visibility(
+                QueueUrl=self.url, ReceiptHandle=receipt,
+                VisibilityTimeout=timeout)
+        except (ClientError, BotoCoreError) as exc:
+            abort("Can't extend task in queue", self.url, exc)
+
+    def done(self, receipt):
+        """Remove a task from the queue"""
+
+        try:
+            self.client.delete_message(QueueUrl=self.url,
+                                       ReceiptHandle=receipt)
+        except (ClientError, BotoCoreError) as exc:
+            abort("Can't remove task from queue", self.url, exc)
+
+################################################################
+
+class FileQueue(object):
+    """A queue of tasks in a local directory
+
+    Each task is a json file.  A worker claims a task by renaming its
+    file (renaming is atomic), and the claim expires when the claimed
+    file has not been touched for the timeout.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def put(self, task):
+        """Add a task to the queue"""
+
+        name = "{:.6f}-{}".format(time.time(), uuid.uuid4().hex)
+        temp = os.path.join(self.directory, name + '.tmp')
+        with open(temp, 'w') as task_file:
+            json.dump(task, task_file)
+        os.rename(temp, os.path.join(self.directory, name + '.json'))
+
+    def expire(self, timeout):
+        """Return expired claims to the queue"""
+
+        for name in os.listdir(self.directory):
+            if not name.endswith('.claimed'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) + timeout < time.time():
+                    os.rename(path, path[:-len('.claimed')] + '.json')
+            except OSError:
+                continue # another worker got there first
+
+    def get(self, wait=WAIT, timeout=TIMEOUT):
+        """Get a task and its receipt from the queue (or None)"""
+
+        start = time.time()
+        while True:
+            self.expire(timeout)
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.directory, name)
+                receipt = path[:-len('.json')] + '.claimed'
+                try:
+                    os.rename(path, receipt)
+                except OSError:
+                    continue # another worker got there first
+                os.utime(receipt, None)
+                with open(receipt) as task_file:
+                    return (json.load(task_file), receipt)
+            if time.time() + POLL > start + wait:
+                return None
+            time.sleep(POLL)
+
+    def extend(self, receipt, timeout=TIMEOUT):
+        """Keep a task hidden from other workers for timeout seconds"""
+
+        # pylint: disable=unused-argument
+        os.utime(receipt, None)
+
+    def done(self, receipt):
+        """Remove a task from the queue"""
+
+        os.remove(receipt)
+
+################################################################
@@ -6,19 +6,39 @@
 
 from __future__ import print_function
 
-import boto3
-import cbmc_status
-import lambda_pipeline
+import base64
+import json
 import os
-import pickle
-import sys
+import time
 import traceback
+import uuid
+
+import boto3
+
+from batch import Batch
+import lambda_pipeline
 
 
 code_pipeline = boto3.client('codepipeline')
 
+# The AWS Batch job queue used by cbmc-batch by default (the job_queue
+# user parameter names another queue)
+JOB_QUEUE = "CBMCJobQueue"
 
-def continue_job_later(job, message, jobs):
+# Version of the format of the continuation token (the tokens written
+# before the format was versioned were pickled job lists)
+TOKEN_VERSION = 1
+
+# CodePipeline limits the length of a continuation token
+TOKEN_MAX_SIZE = 2048
+
+# Bounds on the seconds to wait between polls of AWS Batch while no
+# job is finishing
+BACKOFF_MIN = 60
+BACKOFF_MAX = 600
+
+
+def continue_job_later(job, message, token):
     """Notify CodePipeline of a continuing job
 
     This will cause CodePipeline to invoke the function again with the
@@ -27,7 +47,7 @@ def continue_job_later(job, message, jobs):
     Args:
         job: The JobID
         message: A message to be logged relating to the job status
-        jobs: List of monitored jobs
+        token: The continuation token returned by encode_token
 
     Raises:
         Exception: Any exception thrown by .put_job_success_result()
@@ -36,12 +56,111 @@ def continue_job_later(job, message, jobs):
     # Use the continuation token to keep track of any job execution state
     # This data will be available when a new job is scheduled to continue the
     # current execution
-    continuation_token = pickle.dumps(jobs)
-
     print('Putting job continuation')
     print(message)
     code_pipeline.put_job_success_result(
-            jobId=job, continuationToken=continuation_token)
+            jobId=job, continuationToken=token)
+
+
+def pack_ids(ids):
+    """Pack AWS Batch job ids (uuids) into a base64 string of their bytes"""
+    packed = b''.join(uuid.UUID(jobid).bytes for jobid in ids)
+    return base64.b64encode(packed).decode('ascii')
+
+
+def unpack_ids(packed):
+    """Unpack the AWS Batch job ids packed by pack_ids"""
+    data = base64.b64decode(packed)
+    return [str(uuid.UUID(bytes=data[idx:idx+16]))
+            for idx in range(0, len(data), 16)]
+
+
+def pack_indexes(indexes):
+    """Pack a set of indexes into a base64 string of a bitmap"""
+    bitmap = bytearray((max(indexes) // 8 + 1) if indexes else 0)
+    for index in indexes:
+        bitmap[index // 8] |= 1 << (index % 8)
+    return base64.b64encode(bytes(bitmap)).decode('ascii')
+
+
+def unpack_indexes(packed):
+    """Unpack the set of indexes packed by pack_indexes"""
+    bitmap = bytearray(base64.b64decode(packed))
+    return set(8 * idx + bit
+               for idx, byte in enumerate(bitmap)
+               for bit in range(8) if byte & (1 << bit))
+
+
+def encode_token(state):
+    """Encode the state of the monitored jobs as a continuation token
+
+    Args:
+        state: a dict of the state of the monitored jobs, with
+            ids: AWS Batch job ids of the jobs still outstanding
+            names: indexes into the job list of the input artifact of
+                the jobs still outstanding (or None if unknown)
+            counted: number of succeeded AWS Batch jobs of the
+                outstanding job names counted in succeeded
+            succeeded: number of AWS Batch jobs that have succeeded
+            polled: time of the last poll of AWS Batch
+            backoff: seconds to wait after the last poll before the next poll
+
+    Returns:
+        A compact json string.  The outstanding jobs are given by their
+        packed job ids or, if these are too long for a continuation
+        token, by a bitmap of their indexes into the job list.  If even
+        that is too long, the outstanding jobs are omitted and the next
+        continuation finds them again from the input artifact.
+    """
+    token = {'version': TOKEN_VERSION,
+             'succeeded': state['succeeded'],
+             'polled': int(state['polled']),
+             'backoff': state['backoff']}
+
+    try:
+        token['ids'] = pack_ids(state['ids'])
+        encoded = json.dumps(token, separators=(',', ':'))
+        if len(encoded) <= TOKEN_MAX_SIZE:
+            return encoded
+    except ValueError:
+        print("Job ids are not uuids: " + ", ".join(state['ids']))
+    del token['ids']
+
+    if state.get('names') is not None:
+        token['names'] = pack_indexes(state['names'])
+        token['counted'] = state['counted']
+        encoded = json.dumps(token, separators=(',', ':'))
+        if len(encoded) <= TOKEN_MAX_SIZE:
+            return encoded
+        del token['names']
+
+    # Every job will be polled again, including every job counted
+    token['counted'] = state['succeeded']
+    return json.dumps(token, separators=(',', ':'))
+
+
+def decode_token(encoded):
+    """Decode a continuation token
+
+    Args:
+        encoded: a continuation token
+
+    Returns:
+        The state encoded by encode_token, with ids or names None if
+        the token omits them, or None if the token was written by an
+        older version of this function.
+    """
+    try:
+        token = json.loads(encoded)
+    except ValueError:
+        return None
+    if not isinstance(token, dict) or token.get('version') != TOKEN_VERSION:
+        return None
+    token['ids'] = unpack_ids(token['ids']) if 'ids' in token else None
+    token['names'] = (unpack_indexes(token['names'])
+                      if 'names' in token else None)
+    token.setdefault('counted', 0)
+    return token
 
 
 def read_jobs(input_artifacts):
@@ -63,58 +182,143 @@ def read_jobs(input_artifacts):
     s3 = boto3.client('s3')
     s3.download_file(Bucket=bucket, Key=key, Filename="jobs")
     with open("jobs", "r") as f:
-        return pickle.load(f)
+        return json.load(f)
+
+
+def job_name(job):
+    """The job name of an AWS Batch job (jobname-task, like jobname-build)"""
+    return job['jobName'].rsplit('-', 1)[0]
 
 
-def batch_status(region, project_name, job_id, jobs):
+def poll_jobs(batch, ids, names):
+    """Poll AWS Batch for the status of jobs
+
+    Args:
+        batch: the AWS Batch job queue
+        ids: AWS Batch job ids of jobs to describe
+        names: job names to find on the job queue
+
+    Returns:
+        A tuple of the list of jobs that succeeded, the list of jobs
+        still outstanding, and a description of a failed or missing
+        job (or None).
+    """
+    succeeded = []
+    pending = []
+    failure = None
+
+    jobs = batch.describe_jobs(ids) if ids else []
+    missing = set(ids) - set(job['jobId'] for job in jobs)
+    if missing:
+        failure = "Jobs unknown to AWS Batch: " + ", ".join(sorted(missing))
+
+    if names:
+        statuses = batch.job_statuses(names)
+        unknown = []
+        for name in names:
+            print(name)
+            if not statuses[name]:
+                print("{}: NOT FOUND".format(name))
+                unknown.append(name)
+            jobs.extend(statuses[name])
+        if unknown:
+            failure = failure or ("Jobs not found on AWS Batch job queue: " +
+                                  ", ".join(unknown))
+
+    for job in jobs:
+        line = "{}: {}".format(job['jobName'], job['status'])
+        print(line)
+        if job['status'] == 'FAILED':
+            failure = failure or line
+        elif job['status'] == 'SUCCEEDED':
+            succeeded.append(job)
+        else:
+            pending.append(job)
+
+    return (succeeded, pending, failure)
+
+
+def batch_status(params, job_id, input_artifacts, token=None):
     """Check status of batch jobs
 
     Succeeds, fails or continues the job depending on the batch status.
 
     Args:
-        region: AWS region
-        project_name: project name to use as metrics namespace
+        params: the user parameters: region (the AWS region), project_name
+        (the metrics namespace), and optionally job_queue (the AWS
+        Batch job queue running the jobs)
         job_id: id of Codebuild task
-        jobs: list of job names
+        input_artifacts: input artifacts listing the job names
+        token: the decoded continuation token of the previous invocation
 
     Raises:
         Exception: An exception if no job was found, and any exception thrown
-        while trying to start cbmc_status
+        while trying to query AWS Batch
     """
-    if not jobs:
-        raise Exception("No jobs found")
-
-    all_succeeded = True
-    for job in jobs:
-        print(job)
-
-        # CBMC Batch args -- require that property-checking is performed
-        cbmc_status.sys.argv = ["cbmc_status", "--jobname", job]
-
-        # Run cbmc_status
-        with open("status", "w") as f:
-            stdout = sys.stdout
-            sys.stdout = f
-            cbmc_status.main()
-            sys.stdout = stdout
-
-        with open("status", "r") as f:
-            for line in f:
-                print(line)
-                line = line.rstrip()
-                if line.endswith(": FAILED"):
-                    lambda_pipeline.put_metric(
-                            region, project_name, 'Failures')
-                    lambda_pipeline.put_job_failure(job_id, line)
-                    return
-                elif not line.endswith(": SUCCEEDED"):
-                    all_succeeded = False
-
-    if all_succeeded:
-        lambda_pipeline.put_metric(region, project_name, 'Successes')
-        lambda_pipeline.put_job_success(job_id, "Verification successful")
+    region = params['region']
+    project_name = params['project_name']
+
+    now = time.time()
+    if token is not None and now < token['polled'] + token['backoff']:
+        continue_job_later(
+                job_id, "Verification in progress: waiting to poll",
+                encode_token(token))
+        return
+
+    jobs = None
+    indexes = []
+    if token is None or token['ids'] is None:
+        # Find the outstanding jobs on the job queue
+        jobs = read_jobs(input_artifacts)
+        if token is None:
+            if not jobs:
+                raise Exception("No jobs found")
+            token = {'ids': [], 'names': None, 'counted': 0,
+                     'succeeded': 0, 'backoff': 0}
+        indexes = (range(len(jobs)) if token['names'] is None
+                   else sorted(token['names']))
+        token['ids'] = []
+
+    batch = Batch(queuename=params.get('job_queue', JOB_QUEUE), region=region)
+    (finished, pending, failure) = poll_jobs(batch, token['ids'],
+                                             [jobs[idx] for idx in indexes])
+
+    if failure:
+        lambda_pipeline.put_metric(region, project_name, 'Failures')
+        lambda_pipeline.put_job_failure(job_id, failure)
+        return
+
+    succeeded = token['succeeded'] + len(finished)
+    if jobs is not None:
+        # Every job of the names polled was listed, including the jobs
+        # already counted
+        succeeded -= token['counted']
+        outstanding = set(job_name(job) for job in pending)
+        token['names'] = set(idx for idx in indexes
+                             if jobs[idx] in outstanding)
+        token['counted'] = len([job for job in finished
+                                if job_name(job) in outstanding])
     else:
-        continue_job_later(job_id, "Verification in progress", jobs)
+        token['names'] = None
+
+    if pending:
+        if succeeded > token['succeeded']:
+            token['backoff'] = 0
+        else:
+            token['backoff'] = min(max(2 * token['backoff'], BACKOFF_MIN),
+                                   BACKOFF_MAX)
+        token.update({'ids': [job['jobId'] for job in pending],
+                      'succeeded': succeeded,
+                      'polled': now})
+        continue_job_later(
+                job_id,
+                "Verification in progress: {} jobs succeeded, {} outstanding"
+                .format(succeeded, len(pending)),
+                encode_token(token))
+        return
+
+    lambda_pipeline.put_metric(region, project_name, 'Successes')
+    lambda_pipeline.put_job_success(job_id, "Verification successful")
 
 
 def lambda_handler(event, context):
@@ -140,15 +344,12 @@ def lambda_handler(event, context):
         with lambda_pipeline.make_temp_directory() as d:
             os.chdir(d)
 
+            token = None
             if 'continuationToken' in job_data:
-                jobs = pickle.loads(job_data['continuationToken'])
-            else:
-                # Read job information from input artifact
-                jobs = read_jobs(job_data['inputArtifacts'])
+                token = decode_token(job_data['continuationToken'])
 
             # Check status of batch jobs
-            batch_status(
-                    params['region'], params['project_name'], job_id, jobs)
+            batch_status(params, job_id, job_data['inputArtifacts'], token)
 
     except Exception as e:
         # If any other exceptions which we didn't expect are raised
@@ -6,21 +6,32 @@
 
 from __future__ import print_function
 
-import boto3
-import cbmc_batch
 import glob
-import lambda_pipeline
-import pickle
+import io
+import json
 import os
+import stat
 import tarfile
 import tempfile
+import time
 import traceback
 import zipfile
 
+import boto3
+
+import cbmc_batch
+import lambda_pipeline
+
 
 WS_DIR = "ws"
 SRC_DIR = "src"
 
+# Bytes read from S3 at a time when reading an artifact zip
+READ_SIZE = 4 * 1024 * 1024
+
+# Bytes in each part of a multipart upload (S3 requires at least 5M)
+PART_SIZE = 8 * 1024 * 1024
+
 
 def get_user_params(job_data):
     """Decodes the JSON user parameters and validates the required properties.
@@ -65,18 +76,173 @@ def record_jobs(output_artifacts, jobs):
     bucket = output_artifact['location']['s3Location']['bucketName']
     key = output_artifact['location']['s3Location']['objectKey']
 
-    with tempfile.NamedTemporaryFile() as tmp_file:
-        pickle.dump(jobs, tmp_file)
+    with tempfile.NamedTemporaryFile(mode='w') as tmp_file:
+        json.dump(jobs, tmp_file)
         tmp_file.flush()
         s3 = boto3.client('s3')
         s3.upload_file(Bucket=bucket, Key=key, Filename=tmp_file.name)
 
 
+class S3Reader(io.RawIOBase):
+    """A seekable read-only file reading an S3 object with ranged reads"""
+
+    def __init__(self, s3, bucket, key):
+        super(S3Reader, self).__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError("Invalid whence: {}".format(whence))
+        return self.position
+
+    def readinto(self, buf):
+        if self.position >= self.size or not buf:
+            return 0
+        last = min(self.position + len(buf), self.size) - 1
+        response = self.s3.get_object(
+                Bucket=self.bucket, Key=self.key,
+                Range="bytes={}-{}".format(self.position, last))
+        data = response['Body'].read()
+        buf[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def open_s3_zip(s3, bucket, key):
+    """Open a zip in S3 without downloading it
+
+    Only the blocks of the zip actually read are fetched from S3.
+    """
+    return zipfile.ZipFile(
+            io.BufferedReader(S3Reader(s3, bucket, key), READ_SIZE))
+
+
+class S3MultipartWriter:
+    """A write-only file uploaded to S3 one part at a time
+
+    The upload becomes visible in S3 only when complete() is called,
+    and abort() discards the parts already uploaded.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=PART_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = s3.create_multipart_upload(
+                Bucket=bucket, Key=key)['UploadId']
+        self.parts = []
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.part_size:
+            self.upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def upload_part(self, data):
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                PartNumber=number, Body=data)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': number})
+
+    def complete(self):
+        # Only the last part may be smaller than the minimum part size
+        if self.buffer or not self.parts:
+            self.upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        self.s3.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def zip_entry_tarinfo(info, arcdir):
+    """Describe a zip entry as a tar entry under the directory arcdir
+
+    Raises:
+        ValueError: The zip entry has an absolute or non-canonical path
+    """
+    name = info.filename
+    if name.startswith('/') or '..' in name.split('/'):
+        raise ValueError("Invalid filename: {}".format(name))
+
+    tarinfo = tarfile.TarInfo(arcdir + "/" + name.rstrip('/'))
+    tarinfo.mtime = time.mktime(info.date_time + (0, 0, -1))
+    mode = info.external_attr >> 16
+    if name.endswith('/'):
+        tarinfo.type = tarfile.DIRTYPE
+        tarinfo.mode = stat.S_IMODE(mode) or 0o755
+    elif stat.S_ISLNK(mode):
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.mode = stat.S_IMODE(mode)
+    else:
+        tarinfo.size = info.file_size
+        tarinfo.mode = stat.S_IMODE(mode) or 0o644
+    return tarinfo
+
+
+def repack_zip_to_tar(s3, bucket, key, tar_key, arcdir):
+    """Repack a zip in S3 as a gzipped tar in S3 under the directory arcdir
+
+    The zip entries are read from S3, compressed, and uploaded to S3 a
+    block at a time, so nothing is written to disk.
+    """
+    writer = S3MultipartWriter(s3, bucket, tar_key)
+    try:
+        with open_s3_zip(s3, bucket, key) as zip_file:
+            with tarfile.open(fileobj=writer, mode='w|gz') as tar:
+                tarinfo = tarfile.TarInfo(arcdir)
+                tarinfo.type = tarfile.DIRTYPE
+                tarinfo.mode = 0o755
+                tarinfo.mtime = time.time()
+                tar.addfile(tarinfo)
+                for info in zip_file.infolist():
+                    tarinfo = zip_entry_tarinfo(info, arcdir)
+                    if tarinfo.type == tarfile.SYMTYPE:
+                        tarinfo.linkname = zip_file.read(info).decode('utf-8')
+                        tar.addfile(tarinfo)
+                    elif tarinfo.type == tarfile.DIRTYPE:
+                        tar.addfile(tarinfo)
+                    else:
+                        with zip_file.open(info) as member:
+                            tar.addfile(tarinfo, member)
+    except Exception:
+        writer.abort()
+        raise
+    writer.complete()
+
+
 def extract_artifacts(artifacts, src_artifact, src_key):
-    """Extract all input artifacts into newly created directories
+    """Extract the workspace artifacts and repack the source artifact
 
-    Downloads the artifacts from the S3 artifact store to temporary files and
-    then extracts the zips
+    The workspace artifacts are extracted into newly created
+    directories.  The source artifact is repacked as a tar.gz stored
+    in the S3 artifact store without being written to disk.
 
     Args:
         artifacts: Input artifacts in the job data structure
@@ -84,31 +250,22 @@ def extract_artifacts(artifacts, src_artifact, src_key):
         src_key: S3 key to use to store the source tar.gz
 
     Raises:
-        Exception: Any exception thrown while downloading the artifact or
+        Exception: Any exception thrown while reading the artifact or
         unzipping it
     """
 
-    results = {}
-
     s3 = boto3.client('s3')
     for artifact in artifacts:
         bucket = artifact['location']['s3Location']['bucketName']
         key = artifact['location']['s3Location']['objectKey']
 
-        source_or_workspace = WS_DIR
         if artifact['name'] == src_artifact:
-            source_or_workspace = SRC_DIR
-        os.mkdir(source_or_workspace)
-
-        with tempfile.NamedTemporaryFile() as tmp_file:
-            s3.download_file(Bucket=bucket, Key=key, Filename=tmp_file.name)
-            with zipfile.ZipFile(tmp_file.name, 'r') as zip_file:
-                zip_file.extractall(source_or_workspace)
-
-        if source_or_workspace == SRC_DIR:
-            with tarfile.open("src.tar.gz", "w:gz") as tf:
-                tf.add(SRC_DIR)
-            s3.upload_file(Bucket=bucket, Key=src_key, Filename="src.tar.gz")
+            repack_zip_to_tar(s3, bucket, key, src_key, SRC_DIR)
+            continue
+
+        os.mkdir(WS_DIR)
+        with open_s3_zip(s3, bucket, key) as zip_file:
+            zip_file.extractall(WS_DIR)
 
 
 def start_batch(region, job_id, s3_bucket):
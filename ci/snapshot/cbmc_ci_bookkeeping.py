@@ -0,0 +1,99 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Bookkeeping for CBMC Batch jobs launched by CBMC CI.
+
+The bookkeeping for a job records the GitHub commit and the expected
+result.  It is written when the job is launched, and it is read when
+the job ends to report the result on the commit.
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.exceptions import ClientError
+
+import cbmc_ci_cache
+
+# Name of the object holding the bookkeeping for a CBMC Batch job (the
+# GitHub commit and the expected result) in the job's S3 directory
+BOOKKEEPING_JSON = "bookkeeping.json"
+
+# Number of bookkeeping objects written concurrently at launch time
+BOOKKEEPING_THREADS = 16
+
+
+def bookkeep(bucket, job_name, content):
+    """Upload content to the S3 bucket as job_name/BOOKKEEPING_JSON"""
+    cbmc_ci_cache.call(
+        's3', 'put_object',
+        Bucket=bucket, Key=job_name + "/" + BOOKKEEPING_JSON,
+        Body=json.dumps(content, separators=(',', ':')),
+        ContentType='application/json')
+
+
+class Bookkeeper:
+    """Write the bookkeeping for many CBMC Batch jobs concurrently.
+
+    Launching the jobs for a commit is serial, but the bookkeeping for
+    a job can be written while the next job is being launched.
+    """
+
+    def __init__(self, bucket, threads=BOOKKEEPING_THREADS):
+        self.bucket = bucket
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.futures = {}
+
+    def bookkeep(self, job_name, content):
+        """Write the bookkeeping for job_name in the background"""
+        future = self.executor.submit(bookkeep, self.bucket, job_name,
+                                      content)
+        self.futures[future] = job_name
+
+    def wait(self):
+        """Wait for all writes and return the jobs whose bookkeeping failed"""
+        failed = []
+        for future in as_completed(self.futures):
+            job_name = self.futures[future]
+            exc = future.exception()
+            if exc is not None:
+                print("Failed to bookkeep {}: {}".format(job_name, str(exc)))
+                failed.append(job_name)
+        self.executor.shutdown()
+        self.futures = {}
+        return failed
+
+
+def read_from_s3(bucket, s3_path):
+    """Read a bookkeeping object from the S3 bucket"""
+    return cbmc_ci_cache.call(
+        's3', 'get_object', Bucket=bucket, Key=s3_path)['Body'].read()
+
+
+def read_bookkeeping(bucket, s3_dir):
+    """Read the bookkeeping information about a CBMC Batch job
+
+    The bookkeeping is a single json object written when the job was
+    launched.  Jobs launched before the json object was introduced
+    wrote one text file per field instead.
+    """
+    def read(name):
+        return read_from_s3(bucket, s3_dir + "/" + name)
+
+    try:
+        content = json.loads(read(BOOKKEEPING_JSON).decode('utf-8'))
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        content = {
+            "repo_id": read("repo_id.txt"),
+            "sha": read("sha.txt").decode('ascii'),
+            "is_draft": read("is_draft.txt").decode('ascii'),
+            "expected": read("expected.txt").decode('utf-8')
+        }
+    return {
+        "repo_id": int(content["repo_id"]),
+        "sha": content["sha"],
+        "is_draft": str(content["is_draft"]).lower() == "true",
+        "expected": content["expected"]
+    }
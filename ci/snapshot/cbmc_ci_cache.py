@@ -0,0 +1,97 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Caches of secrets and AWS clients that survive warm lambda invocations.
+
+A lambda reuses its module state between invocations while it stays
+warm, so secrets and clients cached at module level are fetched and
+constructed once per burst of webhook events instead of once per
+event.  Cached values expire after a time to live, and a client or
+secret is refreshed when it fails to authenticate.
+"""
+
+import json
+import os
+import threading
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Seconds that a cached secret or client remains valid
+TTL = int(os.environ.get('CBMC_CI_CACHE_TTL', 15 * 60))
+
+# Error codes returned to a client whose credentials are no longer valid
+AUTH_FAILURES = [
+    'ExpiredToken',
+    'ExpiredTokenException',
+    'InvalidAccessKeyId',
+    'InvalidClientTokenId',
+    'UnrecognizedClientException'
+]
+
+class Cache:
+    """A thread-safe cache of values with a time to live."""
+
+    def __init__(self, make, ttl=TTL):
+        self.make = make
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, *key):
+        """The value for key, made by make(*key) if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.time():
+                entry = (self.make(*key), time.time() + self.ttl)
+                self.entries[key] = entry
+            return entry[0]
+
+    def invalidate(self, *key):
+        """Remove the value for key from the cache"""
+        with self.lock:
+            self.entries.pop(key, None)
+
+clients = Cache(lambda service, region: boto3.client(service,
+                                                     region_name=region))
+secrets = Cache(lambda secret_id: client('secretsmanager').get_secret_value(
+    SecretId=secret_id)['SecretString'])
+
+def client(service, region=None):
+    """The cached boto3 client for service in region"""
+    return clients.get(service, region)
+
+def secret(secret_id):
+    """The cached secret string for secret_id parsed as json"""
+    return json.loads(secrets.get(secret_id))
+
+def invalidate_client(service, region=None):
+    """Refresh the client for service in region on next use"""
+    clients.invalidate(service, region)
+
+def invalidate_secret(secret_id):
+    """Refresh the secret for secret_id on next use"""
+    secrets.invalidate(secret_id)
+
+def is_auth_failure(exc):
+    """The client error is a failure to authenticate"""
+    try:
+        return exc.response['Error']['Code'] in AUTH_FAILURES
+    except (KeyError, AttributeError):
+        return False
+
+def call(service, method, region=None, **kwargs):
+    """Call a method of a cached client
+
+    The client is refreshed and the call retried once if the call
+    fails to authenticate.
+    """
+    try:
+        return getattr(client(service, region), method)(**kwargs)
+    except ClientError as exc:
+        if not is_auth_failure(exc):
+            raise
+        print("Refreshing {} client: {}".format(service, str(exc)))
+        invalidate_client(service, region)
+        return getattr(client(service, region), method)(**kwargs)
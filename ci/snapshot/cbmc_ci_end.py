@@ -8,21 +8,177 @@ import os
 import traceback
 import json
 
-import boto3
+from botocore.exceptions import ClientError
 
-from cbmc_ci_github import update_status
+import bundle
+import cbmc
+import cbmcresult
+import reportupload
+
+import cbmc_ci_cache
+from cbmc_ci_bookkeeping import read_bookkeeping
+from cbmc_ci_github import update_status, flush_status
 
 # S3 Bucket name for storing CBMC Batch packages and outputs
 bkt = os.environ['S3_BKT']
 
+# CBMC ends its output with one of these verification verdicts
+VERDICTS = [b"VERIFICATION SUCCESSFUL", b"VERIFICATION FAILED"]
+
+# Bytes read from the end of the CBMC output when looking for the verdict
+TAIL_SIZE = 64 * 1024
+
+# Bytes read at a time when scanning the entire CBMC output
+CHUNK_SIZE = 1024 * 1024
+
 def read_from_s3(s3_path):
-    """Read from a file in S3 Bucket
+    """Read from a file in S3 Bucket"""
+    return cbmc_ci_cache.call(
+        's3', 'get_object', Bucket=bkt, Key=s3_path)['Body'].read()
+
+def read_tail_from_s3(s3_path, size=TAIL_SIZE):
+    """Read the last size bytes of a file in S3 Bucket
+
+    Returns the bytes read and a flag that is true if the bytes read
+    are the entire file.
+    """
+    try:
+        response = cbmc_ci_cache.call(
+            's3', 'get_object', Bucket=bkt, Key=s3_path,
+            Range="bytes=-{}".format(size))
+    except ClientError as e:
+        # S3 refuses a range request for an empty file
+        if e.response['Error']['Code'] != 'InvalidRange':
+            raise
+        return (b"", True)
+    tail = response['Body'].read()
+    # ContentRange has the form "bytes first-last/length"
+    length = response.get('ContentRange', '').split('/')[-1]
+    return (tail, not length.isdigit() or int(length) <= len(tail))
+
+def scan_from_s3(s3_path, expected, chunk_size=CHUNK_SIZE):
+    """Search a file in S3 Bucket for expected a chunk at a time
+
+    Consecutive chunks overlap so that a match spanning a chunk
+    boundary is found.
+    """
+    body = cbmc_ci_cache.call(
+        's3', 'get_object', Bucket=bkt, Key=s3_path)['Body']
+    overlap = len(expected) - 1
+    window = b""
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            window = (window[-overlap:] if overlap else b"") + chunk
+            if expected in window:
+                return True
+        return False
+    finally:
+        body.close()
+
+def output_contains(s3_path, expected):
+    """Test if the CBMC output in S3 Bucket contains expected as a substring
+
+    The CBMC output with a trace can be hundreds of megabytes, so it
+    is never read into memory in full.  The verdict is at the end of
+    the output, so read the tail of the output first, and scan the
+    whole output only if the tail is inconclusive.
+    """
+    (tail, complete) = read_tail_from_s3(s3_path)
+    if expected in tail:
+        return True
+    if complete:
+        return False
+    if expected in VERDICTS and any(verdict in tail for verdict in VERDICTS):
+        # The output contains only one verdict
+        return False
+    print("No verdict found in tail of {}: scanning all output".format(s3_path))
+    return scan_from_s3(s3_path, expected)
+
+def read_result_from_s3(s3_path):
+    """Read the summary of the CBMC results written by the property phase
+
+    Returns None for jobs run by versions of CBMC Batch that wrote no
+    summary.
+    """
+    try:
+        return cbmcresult.parse(read_from_s3(s3_path).decode('utf-8'))
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        return None
+
+def read_bundle_from_s3(s3_dir):
+    """Open the bundle of the property phase outputs of a job
+
+    Returns None for jobs that wrote their outputs as one object per
+    file.  The members of the bundle are read with ranged GETs.
+    """
+    path = "s3://{}/{}/out/{}".format(
+        bkt, s3_dir, bundle.bundle_name('property'))
+    try:
+        return bundle.open_bundle(path, client=cbmc_ci_cache.client('s3'))
+    except bundle.BundleException:
+        return None
 
-    For getting bookkeeping information from the S3 bucket.
+def job_bundled(s3_dir):
+    """Test if a job wrote its outputs as bundles
+
+    S3 refuses (rather than fails to find) a missing object if the
+    lambda can't list the bucket, so any error means no bundle.
     """
-    s3 = boto3.client('s3')
-    return s3.get_object(Bucket=bkt, Key=s3_path)['Body'].read()
+    try:
+        cbmc_ci_cache.call(
+            's3', 'head_object', Bucket=bkt,
+            Key="{}/out/{}".format(s3_dir, bundle.bundle_name('property')))
+    except ClientError:
+        return False
+    return True
+
+def bundle_contains(archive, expected, chunk_size=CHUNK_SIZE):
+    """Search the CBMC output in a bundle for expected a chunk at a time"""
+    overlap = len(expected) - 1
+    window = b""
+    with archive.open("cbmc.txt") as body:
+        while True:
+            chunk = body.read(chunk_size)
+            if not chunk:
+                return False
+            window = (window[-overlap:] if overlap else b"") + chunk
+            if expected in window:
+                return True
+
+def verification_expected(s3_dir, expected):
+    """Test if the CBMC output for a job contains the expected substring
 
+    When the expected substring is a verdict, the small summary of the
+    CBMC results decides without reading the CBMC output itself.  The
+    outputs are read from the bundle of the property phase when the
+    job wrote its outputs as bundles.
+    """
+    verdict = cbmcresult.expected_verdict(expected)
+    archive = None
+    if verdict is not None:
+        result = read_result_from_s3(
+            s3_dir + "/out/" + cbmcresult.RESULT_JSON)
+        if result is None:
+            archive = read_bundle_from_s3(s3_dir)
+            if (archive is not None and
+                    cbmcresult.RESULT_JSON in archive.namelist()):
+                result = cbmcresult.parse(
+                    archive.read(cbmcresult.RESULT_JSON).decode('utf-8'))
+        if result is not None:
+            print("CBMC result: {}".format(json.dumps(result)))
+            return result['verdict'] == verdict
+    if archive is None:
+        try:
+            return output_contains(s3_dir + "/out/cbmc.txt", expected)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+            archive = read_bundle_from_s3(s3_dir)
+            if archive is None:
+                raise
+    return bundle_contains(archive, expected)
 
 class Job_name_info:
 
@@ -40,7 +196,8 @@ class Job_name_info:
         """Check job_name to see if it matches CBMC Batch naming conventions"""
         job_name_pattern = r"([\S]+)"
         timestamp_pattern = r"(\S{16})"
-        pattern = job_name_pattern + timestamp_pattern + "-property$"
+        # The property phase runs in a property job or a fused job
+        pattern = job_name_pattern + timestamp_pattern + "-(?:property|fused)$"
         res = re.search(pattern, job_name)
         return res
 
@@ -55,6 +212,83 @@ class Job_name_info:
         """
         return self.job_name
 
+def report_job(job_name_info, status):
+    """Update the GitHub commit status with the result of a CBMC Batch job"""
+
+    s3_dir = job_name_info.get_s3_dir()
+    job_dir = job_name_info.get_job_dir()
+    # Prepare description for GitHub status update
+    desc = "CBMC Batch job " + s3_dir + " " + status
+    # Get bookkeeping information about commit and expected result
+    bookkeeping = read_bookkeeping(bkt, s3_dir)
+    repo_id = bookkeeping["repo_id"]
+    sha = bookkeeping["sha"]
+    is_draft = bookkeeping["is_draft"]
+    # The outputs of a bundled job are zip archives: link to the report
+    # index page copied next to them instead
+    page = reportupload.REPORT_INDEX if job_bundled(s3_dir) else None
+    try:
+        # Get expected output substring
+        expected = bookkeeping["expected"].encode('utf-8')
+        # Compare CBMC results with expected result
+        if verification_expected(s3_dir, expected):
+            print("Expected Verification Result: {}".format(s3_dir))
+            update_status(
+                "success", job_dir, s3_dir, desc, repo_id, sha, is_draft,
+                page)
+        else:
+            print("Unexpected Verification Result: {}".format(s3_dir))
+            update_status(
+                "failure", job_dir, s3_dir, desc, repo_id, sha, is_draft,
+                page)
+    except Exception as e:
+        traceback.print_exc()
+        # CBMC Error
+        desc += ": CBMC Error"
+        print(desc)
+        update_status(
+            "error", job_dir, s3_dir, desc, repo_id, sha, False, page)
+        raise e
+
+def pack_name(job_name):
+    """The name of the pack run by a CBMC Batch pack job (or None)"""
+
+    match = re.search(r"^(\S+)-pack$", job_name)
+    return match.group(1) if match else None
+
+def read_pack_status(job_name):
+    """The status of a CBMC Batch job run in a pack
+
+    A job that wrote no status never ran to completion.
+    """
+    try:
+        content = json.loads(read_from_s3(
+            job_name + "/out/" + cbmc.PACK_STATUS).decode('utf-8'))
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        return "FAILED"
+    return content["status"]
+
+def report_pack(pack, status):
+    """Update the GitHub commit status with the result of each job in a pack
+
+    The jobs in a pack are reported as if each had run in its own
+    fused job.
+    """
+    jobs = json.loads(
+        read_from_s3(pack + "/" + cbmc.PACK_MANIFEST).decode('utf-8'))
+    error = None
+    for job in jobs:
+        job_status = (read_pack_status(job['jobname'])
+                      if status == "SUCCEEDED" else status)
+        try:
+            report_job(Job_name_info(job['jobname'] + "-fused"), job_status)
+        except Exception as e: # pylint: disable=broad-except
+            error = e
+    if error is not None:
+        raise error
+
 def lambda_handler(event, context):
     """
     Update the status of the GitHub commit appropriately depending on CBMC
@@ -64,7 +298,8 @@ def lambda_handler(event, context):
 
     While the lambda function gets triggered after any Batch job changes
     status, it should only perform an action when the status is "SUCCEEDED" or
-    "FAILED" for a "-property" job generated by CBMC Batch.
+    "FAILED" for a "-property" (or "-fused") job generated by CBMC Batch,
+    or for a "-pack" job running many CBMC Batch jobs.
 
     The event format from AWS Batch Event is here:
     https://docs.aws.amazon.com/batch/latest/userguide/batch_cwe_events.html
@@ -78,39 +313,17 @@ def lambda_handler(event, context):
     job_name = event["detail"]["jobName"]
     status = event["detail"]["status"]
     job_name_info = Job_name_info(job_name)
-    if (status in ["SUCCEEDED", "FAILED"] and
-            job_name_info.is_cbmc_batch_property_job):
-        s3_dir = job_name_info.get_s3_dir()
-        job_dir = job_name_info.get_job_dir()
-        # Prepare description for GitHub status update
-        desc = "CBMC Batch job " + s3_dir + " " + status
-        # Get bookkeeping information about commit
-        repo_id = int(read_from_s3(s3_dir + "/repo_id.txt"))
-        sha = read_from_s3(s3_dir + "/sha.txt").decode('ascii')
-        draft_status = read_from_s3(s3_dir + "/is_draft.txt").decode('ascii')
-        is_draft = draft_status.lower() == "true"
-        try:
-            # Get expected output substring
-            expected = read_from_s3(s3_dir + "/expected.txt")
-            # Get CBMC output
-            cbmc = read_from_s3(s3_dir + "/out/cbmc.txt")
-            if expected in cbmc:
-                print("Expected Verification Result: {}".format(s3_dir))
-                update_status(
-                    "success", job_dir, s3_dir, desc, repo_id, sha, is_draft)
-            else:
-                print("Unexpected Verification Result: {}".format(s3_dir))
-                update_status(
-                    "failure", job_dir, s3_dir, desc, repo_id, sha, is_draft)
-        except Exception as e:
-            traceback.print_exc()
-            # CBMC Error
-            desc += ": CBMC Error"
-            print(desc)
-            update_status("error", job_dir, s3_dir, desc, repo_id, sha, False)
-            raise e
-    else:
-        print("No action for " + job_name + ": " + status)
+    pack = pack_name(job_name)
+    try:
+        if (status in ["SUCCEEDED", "FAILED"] and
+                job_name_info.is_cbmc_batch_property_job):
+            report_job(job_name_info, status)
+        elif status in ["SUCCEEDED", "FAILED"] and pack is not None:
+            report_pack(pack, status)
+        else:
+            print("No action for " + job_name + ": " + status)
+    finally:
+        flush_status()
 
     # pylint says return None is useless
     # return None
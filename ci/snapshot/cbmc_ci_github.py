@@ -1,21 +1,199 @@
 # Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import collections
 import json
 import os
 import tarfile
+import time
 import urllib
 
-import boto3
 import github
 
+import cbmc_ci_cache
 from cbmc_ci_timer import Timer
 
-def update_github_status(repo_id, sha, status, ctx, desc, jobname):
+# The secret holding the GitHub personal access token
+PAT_SECRET = 'GitHubCommitStatusPAT'
+
+# Stop this many calls short of the GitHub hourly rate limit
+RATE_LIMIT_RESERVE = 50
+
+# Longest time to wait for the GitHub rate limit to reset (or to back
+# off after a rate limit error) before giving up on an update
+MAX_BACKOFF = 60
+
+# The queue of status updates is flushed once it holds FLUSH_BATCH
+# updates or its oldest update has waited MAX_QUEUE_AGE seconds, so a
+# pending status is posted within a few launches of its job
+FLUSH_BATCH = 10
+MAX_QUEUE_AGE = 10
+
+# Most commit objects cached by a warm lambda
+MAX_COMMITS = 100
+
+class GitHubStatusException(Exception):
+    """Exception raised when GitHub status updates could not be sent."""
+
+class StatusUpdater:
+    """Update GitHub commit statuses with as few GitHub API calls as possible.
+
+    One updater lives as long as a warm lambda.  It caches the GitHub
+    client and the most recently used commit objects between
+    invocations, and queues the updates until they are flushed.  A
+    queued update to a commit status is replaced by a later update to
+    the same status before the queue is flushed.  The queue is flushed
+    every few updates, so updates are held only briefly.
+    Nothing stays queued after a flush: an update that can't be sent
+    is reported as failed, so it is never sent by a later, unrelated
+    invocation.
+    """
+
+    def __init__(self):
+        self.github = None
+        self.token = None
+        self.commits = collections.OrderedDict()
+        self.pending = collections.OrderedDict()
+        self.queued = None
+
+    def client(self):
+        """The GitHub client for the current personal access token"""
+        token = get_github_personal_access_token()
+        if self.github is None or token != self.token:
+            self.github = github.Github(token)
+            self.token = token
+            self.commits = collections.OrderedDict()
+        return self.github
+
+    def refresh(self):
+        """Discard the GitHub client and token after an auth failure"""
+        cbmc_ci_cache.invalidate_secret(PAT_SECRET)
+        self.github = None
+        self.token = None
+        self.commits = collections.OrderedDict()
+
+    def commit(self, repo_id, sha):
+        """The GitHub commit object for sha in repository repo_id"""
+        key = (int(repo_id), sha)
+        if key in self.commits:
+            self.commits.move_to_end(key)
+            return self.commits[key]
+        repo = self.client().get_repo(int(repo_id))
+        self.commits[key] = repo.get_commit(sha=sha)
+        while len(self.commits) > MAX_COMMITS:
+            self.commits.popitem(last=False)
+        return self.commits[key]
+
+    def update(self, repo_id, sha, kwds):
+        """Queue an update to a commit status"""
+        key = (int(repo_id), sha, kwds['context'])
+        if key in self.pending:
+            print("Replacing queued update: {}".format(
+                json.dumps(self.pending[key])))
+        self.pending[key] = kwds
+        if self.queued is None:
+            self.queued = time.time()
+
+    def due(self):
+        """The queue holds FLUSH_BATCH updates, or its oldest update has
+        waited MAX_QUEUE_AGE seconds"""
+        return (len(self.pending) >= FLUSH_BATCH or
+                (self.queued is not None and
+                 time.time() - self.queued >= MAX_QUEUE_AGE))
+
+    def wait_for_rate_limit(self):
+        """Wait for the rate limit to reset if too few calls remain
+
+        Returns False if the reset is too far in the future to wait for.
+        """
+        (remaining, limit) = self.client().rate_limiting
+        print("1-hour rate limit remaining: {} of {}".format(remaining, limit))
+        if remaining > RATE_LIMIT_RESERVE:
+            return True
+        delay = self.client().rate_limiting_resettime - time.time()
+        if delay > MAX_BACKOFF:
+            print("Rate limit resets in {} seconds".format(int(delay)))
+            return False
+        time.sleep(max(delay, 0))
+        return True
+
+    def flush(self, report):
+        """Send the queued updates
+
+        Each update is reported to report(kwds, exc) with exc set to
+        the exception raised if the update failed, or to None if it was
+        sent.  The queue is empty after a flush.
+        """
+        try:
+            self.send(report)
+        finally:
+            for kwds in self.pending.values():
+                report(kwds, GitHubStatusException(
+                    "Update not sent before the GitHub rate limit"))
+            self.pending.clear()
+            self.queued = None
+
+    def send(self, report):
+        """Send the queued updates until the queue is empty or the GitHub
+        rate limit blocks the remaining updates
+
+        Backs off and retries while GitHub reports the rate limit
+        exceeded, and refreshes the token once if GitHub rejects it.
+        """
+        backoff = 1
+        refreshed = False
+        while self.pending:
+            if not self.wait_for_rate_limit():
+                return
+            (key, kwds) = next(iter(self.pending.items()))
+            (repo_id, sha, _) = key
+            try:
+                self.commit(repo_id, sha).create_status(**kwds)
+            except github.RateLimitExceededException:
+                if backoff > MAX_BACKOFF:
+                    return
+                print("Rate limit exceeded: retrying in {} seconds"
+                      .format(backoff))
+                time.sleep(backoff)
+                backoff *= 2
+                continue
+            except github.BadCredentialsException as e:
+                if refreshed:
+                    del self.pending[key]
+                    report(kwds, e)
+                    continue
+                print("Bad GitHub credentials: refreshing token")
+                self.refresh()
+                refreshed = True
+                continue
+            #pylint: disable=broad-except
+            except Exception as e:
+                del self.pending[key]
+                report(kwds, e)
+                continue
+            del self.pending[key]
+            report(kwds, None)
+
+# The status updater for this (warm) lambda
+updater = StatusUpdater()
+
+def update_github_status(repo_id, sha, status, ctx, desc, jobname,
+                         page=None):
+    """Queue an update of the GitHub status (if updating is enabled)
+
+    The status links to the job's output folder, or to the object page
+    in the output folder if page is given.
+    """
+    #pylint: disable=too-many-arguments
     kwds = {'state': status,
             'context': "CBMC Batch: " + ctx,
             'description': desc}
-    if jobname:
+    if jobname and page:
+        kwds['target_url'] = (
+            "https://s3.console.aws.amazon.com/s3/object/{}?prefix={}/out/{}"
+            .format(os.environ['S3_BKT'], jobname, page)
+            )
+    elif jobname:
         kwds['target_url'] = (
             "https://s3.console.aws.amazon.com/s3/buckets/{}/{}/out/"
             .format(os.environ['S3_BKT'], jobname)
@@ -23,12 +201,9 @@ def update_github_status(repo_id, sha, status, ctx, desc, jobname):
 
     updating = os.environ.get('CBMC_CI_UPDATING_STATUS')
     if updating and updating.strip().lower() == 'true':
-        print("Updating GitHub status")
+        print("Queueing GitHub status update")
         print(json.dumps(kwds, indent=2))
-        g = github.Github(get_github_personal_access_token())
-        print("Updating GitHub as user: {}".format(g.get_user().login))
-        print("1-hour rate limit remaining: {}".format(g.rate_limiting[0]))
-        g.get_repo(int(repo_id)).get_commit(sha=sha).create_status(**kwds)
+        updater.update(repo_id, sha, kwds)
         return
 
     print("Not updating GitHub status")
@@ -39,14 +214,19 @@ def get_github_personal_access_token():
     Get plaintext for GitHub Personal Access Token (needed for updating commit
     statuses)
     """
-    sm = boto3.client('secretsmanager')
-    s = sm.get_secret_value(SecretId='GitHubCommitStatusPAT')
-    return str(json.loads(s['SecretString'])[0]['GitHubPAT'])
+    return str(cbmc_ci_cache.secret(PAT_SECRET)[0]['GitHubPAT'])
 
 
-def update_status(status, ctx, jobname, desc, repo_id, sha, no_status_metric):
+def update_status(status, ctx, jobname, desc, repo_id, sha, no_status_metric,
+                  page=None):
     """Update GitHub Status
 
+    The update is queued, and the queue is flushed now if it holds
+    FLUSH_BATCH updates or its oldest update has waited MAX_QUEUE_AGE
+    seconds.  Updates still queued are sent by the next call to
+    flush_status.  The status links to the object page in the
+    job's output folder if page is given, and to the folder otherwise.
+
     Relevant documentation:
     https://developer.github.com/v3/repos/statuses/#create-a-status
     http://pygithub.readthedocs.io/en/latest/github_objects/Commit.html
@@ -62,65 +242,82 @@ def update_status(status, ctx, jobname, desc, repo_id, sha, no_status_metric):
         "success": "Successes",
         "failure": "Failures"
     }
-    cloudwatch = boto3.client("cloudwatch", region_name=region)
 
     if not no_status_metric:
-        cloudwatch.put_metric_data(
-            MetricData=[
-                {
-                    'MetricName': status_to_metric[status],
-                    'Unit': 'None',
-                    'Value': 1.0
-                },
-            ],
-            Namespace=os.environ['PROJECT_NAME']
-        )
-
-    timer = Timer("Updating GitHub status {} with description {}".format(
-        status, desc))
+        put_metric(region, status_to_metric[status])
+
+    update_github_status(repo_id, sha, status, ctx, desc, jobname, page)
+    if updater.due():
+        flush_status()
+
+
+def flush_status():
+    """Send the queued GitHub status updates
+
+    A failed update is logged and counted in the project metrics.
+    """
+    region = os.environ['AWS_REGION']
+
+    def report(kwds, exc):
+        if exc is None:
+            put_metric(region, 'GitHub status update succeeded')
+            return
+        print("Failed to update status on GitHub: {}: {}".format(
+            json.dumps(kwds), str(exc)))
+        put_metric(region, 'GitHub status update failed')
+
+    timer = Timer("Updating {} GitHub statuses".format(len(updater.pending)))
+    # pylint: disable=broad-except
     try:
-        update_github_status(repo_id, sha, status, ctx, desc, jobname)
-        cloudwatch.put_metric_data(
-            MetricData=[
-                {
-                    'MetricName': 'GitHub status update succeeded',
-                    'Unit': 'None',
-                    'Value': 1.0
-                },
-            ],
-            Namespace=os.environ['PROJECT_NAME']
-        )
-    #pylint: disable=broad-except
+        updater.flush(report)
     except Exception as e:
         print("Failed to update status on GitHub: " + str(e))
-        cloudwatch.put_metric_data(
-            MetricData=[
-                {
-                    'MetricName': 'GitHub status update failed',
-                    'Unit': 'None',
-                    'Value': 1.0
-                },
-            ],
-            Namespace=os.environ['PROJECT_NAME']
-        )
     timer.end()
 
 
+def put_metric(region, name):
+    """Count one event in the project metrics"""
+    cbmc_ci_cache.call(
+        "cloudwatch", "put_metric_data", region,
+        MetricData=[
+            {
+                'MetricName': name,
+                'Unit': 'None',
+                'Value': 1.0
+            },
+        ],
+        Namespace=os.environ['PROJECT_NAME']
+    )
+
+
 def fetch_tar(tar_path, tar_URL):
     """
     Download tar_URL to tar_path.
 
     GitHub may require authorization in case of private repositories. This is
     accomplished by setting an "Authorization" HTTP header to the GitHub
-    personal access (OAuth) token.
+    personal access (OAuth) token.  The token is refreshed and the
+    download retried once if GitHub rejects a cached token.
     """
     print("downloading {} to {}".format(tar_URL, tar_path))
+    try:
+        response = open_tar_url(tar_URL)
+    except urllib.error.HTTPError as e:
+        if e.code != 401:
+            raise
+        print("Bad GitHub credentials: refreshing token")
+        cbmc_ci_cache.invalidate_secret(PAT_SECRET)
+        response = open_tar_url(tar_URL)
+    with open(tar_path, "wb") as tar:
+        tar.write(response.read())
+
+
+def open_tar_url(tar_URL):
+    """Open tar_URL with the GitHub personal access token"""
     token = get_github_personal_access_token()
     request = urllib.request.Request(
         url=tar_URL, headers={"Authorization": "token " + token})
-    response = urllib.request.urlopen(request)
-    with open(tar_path, "wb") as tar:
-        tar.write(response.read())
+    return urllib.request.urlopen(request)
 
 
 def extract_tar(tmp_dir, tar_path):
@@ -177,7 +374,7 @@ def get_tar(name, full_name, sha, tmp_dir):
     timer.end()
 
     timer = Timer("Uploading tar containing code for commit to S3")
-    s3 = boto3.client('s3')
+    s3 = cbmc_ci_cache.client('s3')
     s3.upload_file(
         Bucket=os.environ['S3_BKT'], Key=tar_file, Filename=tar_path)
     timer.end()
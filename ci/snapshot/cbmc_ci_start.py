@@ -13,11 +13,10 @@ import time
 import traceback
 from yaml import load
 
-import boto3
-
-
-
+import cbmc
 import cbmc_batch
+import cbmc_ci_bookkeeping
+import cbmc_ci_cache
 import cbmc_ci_github
 from cbmc_ci_timer import Timer
 
@@ -101,8 +100,8 @@ def lambda_handler(event, context):
                   format(name, branch, json.dumps(event)))
             return 0
 
-        codebuild = boto3.client('codebuild')
-        codebuild.start_build(
+        cbmc_ci_cache.call(
+            'codebuild', 'start_build',
             projectName='Prepare-Source-Project',
             environmentVariablesOverride=[
                 {
@@ -190,7 +189,7 @@ def find_tasks(group_names, topdir='.'):
             for groupdir in find_proof_groups(group_names, topdir)
             for proofdir in find_proofs(groupdir)]
 
-def run_batch(region, ws, src, task_name, tar_file):
+def run_batch(region, ws, src, task_name, tar_file, packer=None):
     """Run the CBMC Batch job.
 
     Inputs: region - AWS region Batch is running in
@@ -198,8 +197,10 @@ def run_batch(region, ws, src, task_name, tar_file):
             src - source code directory,
             task_name - name of task
             tar_file - source archive file name
+            packer - packer for small jobs (optional)
     Outputs: Expected result substring
     """
+    #pylint: disable=too-many-arguments
     # Expect a Makefile in the directory
     if not os.path.isfile(join(ws, "Makefile")):
         raise ValueError("Missing Makefile from " + ws)
@@ -248,7 +249,12 @@ def run_batch(region, ws, src, task_name, tar_file):
     timer = Timer("Run CBMC Batch")
     print("CBMC Batch options")
     print(json.dumps(cbmc_batch.sys.argv))
-    cbmc_batch.main()
+    if packer is None:
+        cbmc_batch.main()
+    else:
+        opts = cbmc_batch.main(submit=False)
+        if not packer.add(opts):
+            cbmc_batch.submit_job(opts)
     timer.end()
 
     # Return expected result for bookkeeping
@@ -256,15 +262,27 @@ def run_batch(region, ws, src, task_name, tar_file):
 
 
 def batch_bookkeep(
-        tmp_dir, repo_id, sha, is_draft, expected, subdir, batch_name):
+        repo_id, sha, is_draft, expected, subdir, batch_name, bookkeeper=None):
+    """Bookkeep a CBMC Batch job and mark its commit status as pending.
+
+    The bookkeeping is written by the bookkeeper if one is given (so
+    that the writes for many jobs can proceed concurrently) and is
+    written immediately otherwise.
+    """
     #pylint: disable=too-many-arguments
 
-    # Bookkeeping about the GitHub commit for later response
-    bookkeep(tmp_dir, batch_name, repo_id, "repo_id.txt")
-    bookkeep(tmp_dir, batch_name, sha, "sha.txt")
-    bookkeep(tmp_dir, batch_name, is_draft, "is_draft.txt")
-    # Bookkeeping about expected result for later response
-    bookkeep(tmp_dir, batch_name, expected, "expected.txt")
+    # Bookkeeping about the GitHub commit and the expected result for
+    # later response
+    content = {
+        "repo_id": repo_id,
+        "sha": sha,
+        "is_draft": is_draft,
+        "expected": str(expected)
+    }
+    if bookkeeper:
+        bookkeeper.bookkeep(batch_name, content)
+    else:
+        cbmc_ci_bookkeeping.bookkeep(bkt, batch_name, content)
     # Update commit status to pending
     desc = "Verification Pending: CBMC Batch job " + batch_name
     cbmc_ci_github.update_status(
@@ -281,11 +299,59 @@ def expected_result(yaml):
     return ""
 
 
-def bookkeep(tmp_dir, job_name, content, file_name):
-    """Upload tmp_dir/file_name to the S3 bucket as job_name/file_name"""
-    file_path = join(tmp_dir, file_name)
-    with open(file_path, "w") as file_obj:
-        file_obj.write(str(content))
-    s3 = boto3.client('s3')
-    s3.upload_file(
-        Bucket=bkt, Key=job_name + "/" + file_name, Filename=file_path)
+class Packer:
+    """Submit small CBMC Batch jobs in packs run by one container each.
+
+    A job is small if CBMC Batch would run all of its steps in one
+    container.  Each pack runs up to size jobs, and each job in a pack
+    keeps its own name, output, and status, so the result of each job
+    is reported just as for a job run by itself.  The names of the jobs
+    that could not be launched are collected in failed.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.jobs = []
+        self.failed = []
+        self.count = 0
+        gmt = time.gmtime()
+        self.timestamp = ("{:04d}{:02d}{:02d}-{:02d}{:02d}{:02d}"
+                          .format(gmt.tm_year, gmt.tm_mon, gmt.tm_mday,
+                                  gmt.tm_hour, gmt.tm_min, gmt.tm_sec))
+
+    def add(self, opts):
+        """Add a job to a pack (False if the job is too large to pack)"""
+        if self.size <= 1 or not cbmc.CBMC(opts).fused():
+            return False
+        self.jobs.append(opts)
+        if len(self.jobs) >= self.size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Submit the pending jobs as a pack"""
+        if not self.jobs:
+            return
+        (jobs, self.jobs) = (self.jobs, [])
+        self.count += 1
+        packname = "cbmc-{}-{}".format(self.timestamp, self.count)
+        try:
+            pack = cbmc.submit_pack(jobs, packname)
+        except Exception: # pylint: disable=broad-except
+            traceback.print_exc()
+            print("Failed to submit pack {}: submitting jobs one at a time"
+                  .format(packname))
+            for opts in jobs:
+                try:
+                    cbmc_batch.submit_job(opts)
+                except Exception: # pylint: disable=broad-except
+                    traceback.print_exc()
+                    print("Failed to submit job {}".format(opts['jobname']))
+                    self.failed.append(opts['jobname'])
+            return
+        for opts in jobs:
+            results = {phase: (pack if opts[phase] else
+                               {'jobid': None, 'jobname': None})
+                       for phase in ['build', 'property', 'coverage', 'report']}
+            results['jobname'] = opts['jobname']
+            cbmc_batch.report_job(opts, results)
@@ -15,6 +15,7 @@ import traceback
 
 import boto3
 
+import cbmc_ci_bookkeeping
 import cbmc_ci_start
 import cbmc_ci_github
 
@@ -111,6 +112,20 @@ def get_arguments():
         help='Filename for the tar file.'
     )
 
+    ################################################################
+    # Packing
+    parser.add_argument(
+        '--pack-size',
+        metavar='N',
+        type=int,
+        help="""
+        Run small proofs in packs of up to N proofs per container,
+        where a proof is small if it runs in one container (see the
+        --fused and --fused-threshold options of cbmc-batch)
+        (default: 0, run each proof on its own).
+        """
+    )
+
     ################################################################
     # Logging level
     parser.add_argument(
@@ -155,6 +170,10 @@ def get_arguments():
         arg.tarfile_path = env if env else None
     if not arg.tarfile_name:
         arg.tarfile_name = make_tarfile_name(arg.repository, arg.sha)
+    if arg.pack_size is None:
+        # Environment value could be an empty string
+        env = os.environ.get('CBMC_PACK_SIZE')
+        arg.pack_size = int(env) if env else 0
     return arg
 
 ################################################################
@@ -322,20 +341,28 @@ def generate_cbmc_makefiles(group_names, root):
 ################################################################
 # CBMC Batch
 
-def generate_cbmc_jobs(src, repo_id, repo_sha, is_draft, tarfile):
+def generate_cbmc_jobs(src, repo_id, repo_sha, is_draft, tarfile, pack_size=0):
     # Find (proof-name, proof-directory) pairs for all proofs under src
     tasks = find_tasks(PROOF_MARKERS, src)
     print("{} tasks found".format(len(tasks)))
 
+    # Bookkeeping is written in the background while later jobs launch
+    bookkeeper = cbmc_ci_bookkeeping.Bookkeeper(BKT)
+    # Small proofs are run in packs
+    packer = cbmc_ci_start.Packer(pack_size) if pack_size > 1 else None
+    proofnames = {}
+
     for (proofname, proofdir) in tasks:
         # pylint: disable=broad-except
         try:
             # Try to run batch
             (jobname, expected) = cbmc_ci_start.run_batch(
-                os.environ['AWS_REGION'], proofdir, src, proofname, tarfile)
+                os.environ['AWS_REGION'], proofdir, src, proofname, tarfile,
+                packer)
+            proofnames[jobname] = proofname
             cbmc_ci_start.batch_bookkeep(
-                ".", repo_id, repo_sha, is_draft, expected, proofname,
-                jobname)
+                repo_id, repo_sha, is_draft, expected, proofname, jobname,
+                bookkeeper)
         except Exception as e:
             # Update commit status to error
             traceback.print_exc()
@@ -344,6 +371,30 @@ def generate_cbmc_jobs(src, repo_id, repo_sha, is_draft, tarfile):
                 "Problem launching verification", repo_id, repo_sha, False)
             print("Error: " + str(e))
 
+    # Send the pending statuses still queued for the last jobs launched
+    cbmc_ci_github.flush_status()
+
+    if packer is not None:
+        # pylint: disable=broad-except
+        try:
+            # Submit the last (partial) pack
+            packer.flush()
+        except Exception as e:
+            traceback.print_exc()
+            print("Error: " + str(e))
+        for jobname in packer.failed:
+            cbmc_ci_github.update_status(
+                "error", proofnames[jobname], None,
+                "Problem launching verification", repo_id, repo_sha, False)
+
+    for jobname in bookkeeper.wait():
+        # Without bookkeeping, the result of the job can't be reported
+        cbmc_ci_github.update_status(
+            "error", proofnames[jobname], jobname,
+            "Problem bookkeeping verification", repo_id, repo_sha, False)
+
+    cbmc_ci_github.flush_status()
+
 
 
 ################################################################
@@ -361,7 +412,8 @@ def source_prepare():
     generate_tarfile(arg.tarfile_name, base_name)
     upload_tarfile_to_s3(arg.tarfile_name, arg.bucket, arg.tarfile_path)
     generate_cbmc_jobs(
-        base_name, arg.id, arg.sha, arg.is_draft, arg.tarfile_name)
+        base_name, arg.id, arg.sha, arg.is_draft, arg.tarfile_name,
+        arg.pack_size)
 
 ################################################################
 
@@ -3,20 +3,25 @@
 
 import time
 
+import botocore
+
 STABLE_STACK_TIMEOUT = 15 * 60 # Wait 15 minutes for stacks to stablize
+STABLE_STACK_DELAY = 5 # Wait 5 seconds between checks for stable stacks
+STABLE_STACK_MAX_DELAY = 30 # Wait at most 30 seconds between checks
 
 class Stacks():
     def __init__(self, session):
         self.session = session
         self.client = self.session.client("cloudformation")
-        self.description = None
-        self.stack = None
+        self.stack = {}
+        self.output_index = {}
+        self.last_event = {}
         self.update()
 
     ################################################################
 
-    def update(self):
-        self.description = self.client.describe_stacks()
+    def update(self, stacks=None):
+        """Update the description of the given stacks (or all stacks)."""
 
         def parse_parameters(params):
             return {param['ParameterKey']: param['ParameterValue'] for param in params}
@@ -25,17 +30,72 @@ class Stacks():
             return {out.get('ExportName') or out.get('OutputKey'): out['OutputValue']
                     for out in outs}
 
-        def parse_stacks(stks):
-            return {stk['StackName']:
-                    {
-                        "parameters": parse_parameters(stk.get('Parameters', [])),
-                        "outputs": parse_outputs(stk.get('Outputs', [])),
-                        "status": stk['StackStatus'],
-                        "statusreason": stk.get('StackStatusReason')
-                    }
-                    for stk in stks}
+        def parse_stack(stk):
+            return {
+                "parameters": parse_parameters(stk.get('Parameters', [])),
+                "outputs": parse_outputs(stk.get('Outputs', [])),
+                "status": stk['StackStatus'],
+                "statusreason": stk.get('StackStatusReason')
+            }
 
-        self.stack = parse_stacks(self.description['Stacks'])
+        if stacks is None:
+            paginator = self.client.get_paginator('describe_stacks')
+            self.stack = {stk['StackName']: parse_stack(stk)
+                          for page in paginator.paginate()
+                          for stk in page['Stacks']}
+        else:
+            for stack in stacks:
+                try:
+                    stks = self.client.describe_stacks(StackName=stack)['Stacks']
+                except botocore.exceptions.ClientError as err:
+                    if 'does not exist' not in err.response['Error']['Message']:
+                        raise
+                    stks = []
+                self.stack.pop(stack, None)
+                for stk in stks:
+                    self.stack[stk['StackName']] = parse_stack(stk)
+
+        # Index the stack defining each output
+        self.output_index = {}
+        for stk in sorted(self.stack):
+            for output in self.stack[stk]['outputs']:
+                self.output_index.setdefault(output, stk)
+
+    def new_events(self, stack):
+        """The events of a stack since the last call, oldest first.
+
+        The first call for a stack returns no events, and marks the
+        point in the event history that later calls return events from
+        (the beginning of the history if the stack does not exist yet).
+        """
+
+        last = self.last_event.get(stack)
+        events = []
+        kwargs = {'StackName': stack}
+        try:
+            while True:
+                response = self.client.describe_stack_events(**kwargs)
+                page = response['StackEvents'] # newest event first
+                found = last in [event['EventId'] for event in page]
+                for event in page:
+                    if event['EventId'] == last:
+                        break
+                    events.append(event)
+                if found or last is None or not response.get('NextToken'):
+                    break
+                kwargs['NextToken'] = response['NextToken']
+        except botocore.exceptions.ClientError as err:
+            if 'does not exist' not in err.response['Error']['Message']:
+                raise
+            # Every event of a stack created later is new
+            self.last_event.setdefault(stack, '')
+            return []
+
+        if events:
+            self.last_event[stack] = events[0]['EventId']
+        if last is None:
+            return []
+        return list(reversed(events))
 
     ################################################################
 
@@ -60,10 +120,10 @@ class Stacks():
             return self.stack[stack]['outputs']
         if stack is None and output is not None:
             # assuming output appears in only one stack (or output values equal)
-            for stk in self.stack:
-                if output in self.stack[stk]['outputs']:
-                    return self.stack[stk]['outputs'][output]
-            return None
+            stk = self.output_index.get(output)
+            if stk is None:
+                return None
+            return self.stack[stk]['outputs'][output]
         return self.stack[stack]['outputs'][output]
 
     def get_client(self):
@@ -103,14 +163,30 @@ class Stacks():
             stacks = self.stack.keys()
         return all([self.successful_stack(stack) for stack in stacks])
 
+    def poll(self, stacks):
+        """Update the given stacks and print their status and new events.
+
+        Returns True if any of the stacks has new events.
+        """
+
+        self.update(stacks)
+
+        changed = False
+        print("\nStack status:")
+        for stack in sorted(stacks):
+            print("  {:20}: {}".format(stack, self.get_status(stack)))
+            for event in self.new_events(stack):
+                changed = True
+                print("    {} {:30} {} {}".format(
+                    event['Timestamp'].strftime('%H:%M:%S'),
+                    event['LogicalResourceId'],
+                    event['ResourceStatus'],
+                    event.get('ResourceStatusReason') or ''))
+        return changed
+
     def wait_for_stable_stacks(self, stacks=None):
         if stacks is None:
-            stacks = self.stack.keys()
-
-        def print_statuses(statuses):
-            print("\nStack status:")
-            for stack in sorted(statuses.keys()):
-                print("  {:20}: {}".format(stack, statuses[stack]))
+            stacks = list(self.stack.keys())
 
         # One might use a cloudformation waiter here, but a waiter can
         # wait on only one stack and only one status.  Here there are
@@ -118,14 +194,19 @@ class Stacks():
         # stack.  Also, waiters print no progress information during
         # the wait.
 
+        for stack in stacks:
+            self.new_events(stack)
+
+        delay = STABLE_STACK_DELAY
         start = time.time()
         while time.time() < start + STABLE_STACK_TIMEOUT:
-            self.update()
-            statuses = self.get_statuses(stacks)
-            print_statuses(statuses)
-            if self.stable_stacks(statuses):
+            changed = self.poll(stacks)
+            if self.stable_stacks(stacks):
                 return
-            time.sleep(5)
+            # Back off while the stacks are quiet
+            delay = (STABLE_STACK_DELAY if changed
+                     else min(2 * delay, STABLE_STACK_MAX_DELAY))
+            time.sleep(delay)
 
         raise UserWarning("Timed out waiting for stacks to stabilize")
 
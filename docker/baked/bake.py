@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Copy packages from S3 into the build context for an image with the
+packages baked in, and record the name and ETag of each package."""
+
+import argparse
+import json
+import os
+
+import boto3
+
+def create_parser():
+    """Create the command line parser"""
+
+    parser = argparse.ArgumentParser(
+        description='Copy packages from S3 to bake into an image')
+    parser.add_argument('--directory', default='packages',
+                        help='Directory to copy the packages into')
+    parser.add_argument('--pkgbucket', required=True,
+                        help='S3 path to the bucket holding the packages '
+                        '(s3://bucket/package)')
+    parser.add_argument('--cbmcpkg', required=True,
+                        help='Name of the cbmc package')
+    parser.add_argument('--viewerpkg', required=True,
+                        help='Name of the cbmc-viewer package')
+    parser.add_argument('--batchpkg', required=True,
+                        help='Name of the cbmc-batch package')
+    parser.add_argument('--region',
+                        help='AWS region of the bucket')
+    return parser
+
+def copy_package(client, pkgbucket, tar, directory):
+    """Copy a package into the directory and return its ETag"""
+
+    path = pkgbucket[len('s3://'):] if pkgbucket.startswith('s3://') \
+           else pkgbucket
+    (bucket, _, prefix) = path.partition('/')
+    key = '{}/{}'.format(prefix, tar) if prefix else tar
+
+    print("Copying package s3://{}/{}".format(bucket, key))
+    etag = client.head_object(Bucket=bucket, Key=key)['ETag']
+    client.download_file(bucket, key, os.path.join(directory, tar))
+    return etag
+
+def main():
+    """Copy the packages and write baked.json"""
+
+    args = create_parser().parse_args()
+    client = boto3.client('s3', region_name=args.region)
+    if not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+
+    baked = {}
+    for (pkg, tar) in [('cbmc', args.cbmcpkg),
+                       ('cbmc-viewer', args.viewerpkg),
+                       ('cbmc-batch', args.batchpkg)]:
+        etag = copy_package(client, args.pkgbucket, tar, args.directory)
+        baked[pkg] = {'package': tar, 'etag': etag}
+
+    with open(os.path.join(args.directory, 'baked.json'), 'w') as jfile:
+        json.dump(baked, jfile, indent=2)
+
+if __name__ == "__main__":
+    main()